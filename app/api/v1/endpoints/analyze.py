@@ -1,14 +1,114 @@
+import json
 import time
 import uuid
 import traceback
-from fastapi import APIRouter, Request, HTTPException
-from fastapi.responses import JSONResponse
-from ....schemas.requests import AnalyzeRoomRequest, AnalyzeRoomResponse
+from fastapi import APIRouter, Request, HTTPException, Query
+from fastapi.responses import JSONResponse, StreamingResponse
+from ....schemas.requests import (
+    AnalyzeRoomRequest, AnalyzeRoomResponse, AnalyzeStreamResult, AnalyzeStreamSummary
+)
+from ....core.config import settings
 from ....core.logging import logger
-from ....services.image_service import process_batch_images
+from ....services.image_service import (
+    process_batch_images, iter_batch_images, process_uploaded_images
+)
+from ....utils.image_format import ImageIngestError
+from ....utils.deadline import Deadline
+from ....services.scheduler import set_flow, INTERACTIVE, BULK
+from ....services.admission import admission_controller, AdmissionRejected
+from ....services.token_usage import start_usage_tracking
+from ....utils.upload_utils import UploadError, iter_multipart_images, read_image_body
 
 router = APIRouter()
 
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+SSE_MEDIA_TYPE = "text/event-stream"
+
+
+def _set_scheduling_flow(http_request: Request, image_count):
+    """按客户端标识头(缺省为客户端IP)和通道设置公平调度身份
+
+    未通过通道头指定时，小批量请求进入interactive通道，大批量和图片数未知(image_count为None)的请求进入bulk通道
+    """
+    flow = http_request.headers.get(settings.FAIR_FLOW_HEADER)
+    if not flow and http_request.client is not None:
+        flow = http_request.client.host
+    lane = http_request.headers.get(settings.FAIR_LANE_HEADER, '').lower()
+    if lane not in (INTERACTIVE, BULK):
+        lane = INTERACTIVE if image_count is not None and image_count <= settings.FAIR_INTERACTIVE_MAX_URLS else BULK
+    set_flow(flow, lane)
+    return lane
+
+
+class _AdmittedStreamingResponse(StreamingResponse):
+    """流式响应结束时归还准入名额
+
+    名额通常由iter_batch_images在生成器结束时归还；客户端在开始发送前断开时生成器从未开始迭代，
+    其finally不会执行，因此在响应外层再归还一次(重复归还不生效)
+    """
+
+    def __init__(self, content, ticket, **kwargs):
+        super().__init__(content, **kwargs)
+        self._ticket = ticket
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self._ticket.close()
+
+
+def _stream_media_type(request: AnalyzeRoomRequest, http_request: Request):
+    """根据Accept头或stream参数选择流式格式，非流式请求返回None"""
+    accept = http_request.headers.get('accept', '').lower()
+    if SSE_MEDIA_TYPE in accept:
+        return SSE_MEDIA_TYPE
+    if NDJSON_MEDIA_TYPE in accept or 'application/jsonl' in accept:
+        return NDJSON_MEDIA_TYPE
+    if request.stream:
+        return NDJSON_MEDIA_TYPE
+    return None
+
+
+def _format_record(record, media_type):
+    data = json.dumps(record.model_dump(), ensure_ascii=False)
+    if media_type == SSE_MEDIA_TYPE:
+        return f"event: {record.type}\ndata: {data}\n\n"
+    return data + "\n"
+
+
+async def _stream_results(urls, include_description, request_id, media_type, start_time, deadline, ticket, usage):
+    """按完成顺序逐条发送结果，最后发送汇总记录"""
+    succeeded = 0
+    timed_out = 0
+    async for index, result in iter_batch_images(urls, include_description, request_id, deadline, ticket):
+        if result.get('success', False):
+            succeeded += 1
+        elif result.get('timed_out', False):
+            timed_out += 1
+        yield _format_record(AnalyzeStreamResult(index=index, **result), media_type)
+
+    total_time = time.time() - start_time
+    logger.info(
+        f"Streaming batch processing completed",
+        request_id=request_id,
+        total_images=len(urls),
+        failed_count=len(urls) - succeeded,
+        timed_out_count=timed_out,
+        total_duration=f"{total_time:.3f}s",
+        **usage.to_dict()
+    )
+    yield _format_record(AnalyzeStreamSummary(
+        success=True,
+        total=len(urls),
+        succeeded=succeeded,
+        failed=len(urls) - succeeded,
+        timed_out=timed_out,
+        processing_time=f"{total_time:.3f}s",
+        token_usage=usage.to_dict(),
+        request_id=request_id
+    ), media_type)
+
 
 @router.post("/analyze_room", response_model=AnalyzeRoomResponse)
 async def analyze_room(request: AnalyzeRoomRequest, http_request: Request):
@@ -18,6 +118,7 @@ async def analyze_room(request: AnalyzeRoomRequest, http_request: Request):
     
     try:
         start_time = time.time()
+        deadline = Deadline.from_ms(request.deadline_ms)
         urls = request.url
         include_description = request.include_description
         
@@ -26,6 +127,7 @@ async def analyze_room(request: AnalyzeRoomRequest, http_request: Request):
             request_id=request_id,
             urls_count=len(urls) if isinstance(urls, list) else 1,
             include_description=include_description,
+            deadline=f"{deadline.timeout:.3f}s" if deadline else None,
             raw_urls=urls if isinstance(urls, list) else [urls]
         )
 
@@ -60,23 +162,71 @@ async def analyze_room(request: AnalyzeRoomRequest, http_request: Request):
                 'error': error_msg
             })
 
+        lane = _set_scheduling_flow(http_request, len(urls))
+        usage = start_usage_tracking()
+
+        # 准入控制: 批次过大、排队已满或预计无法在时间预算内完成时立即拒绝
+        try:
+            ticket = admission_controller.admit(len(urls), lane, deadline)
+        except AdmissionRejected as e:
+            logger.warning(
+                f"Request rejected by admission control",
+                request_id=request_id,
+                reason=e.reason,
+                lane=lane,
+                urls_count=len(urls),
+                retry_after=e.retry_after
+            )
+            return JSONResponse(
+                status_code=e.status_code,
+                content={
+                    'success': False,
+                    'request_id': request_id,
+                    'error': str(e),
+                    'error_type': 'AdmissionRejected'
+                },
+                headers={'Retry-After': str(e.retry_after)} if e.retry_after else None
+            )
+
+        # 流式模式: 每张图片完成后立即发送结果
+        media_type = _stream_media_type(request, http_request)
+        if media_type is not None:
+            logger.info(
+                f"Streaming batch results",
+                request_id=request_id,
+                media_type=media_type,
+                lane=lane
+            )
+            return _AdmittedStreamingResponse(
+                _stream_results(urls, include_description, request_id, media_type, start_time, deadline, ticket, usage),
+                ticket,
+                media_type=media_type,
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
+
         # 处理图片
-        results = await process_batch_images(urls, include_description, request_id)
+        results = await process_batch_images(urls, include_description, request_id, deadline, ticket)
 
         # 统计结果
         total_time = time.time() - start_time
+        timed_out = sum(1 for result in results if result.get('timed_out', False))
         
         logger.info(
             f"Batch processing completed",
             request_id=request_id,
             total_images=len(urls),
-            total_duration=f"{total_time:.3f}s"
+            timed_out_count=timed_out,
+            lane=lane,
+            total_duration=f"{total_time:.3f}s",
+            **usage.to_dict()
         )
 
         return {
             'success': True,
             'total': len(urls),
+            'timed_out': timed_out,
             'processing_time': f"{total_time:.3f}s",
+            'token_usage': usage.to_dict(),
             'results': results
         }
     except Exception as e:
@@ -94,4 +244,84 @@ async def analyze_room(request: AnalyzeRoomRequest, http_request: Request):
             'request_id': request_id,
             'error': str(e),
             'error_type': type(e).__name__
-        }) 
\ No newline at end of file
+        }) 
+
+async def _single_upload(http_request: Request):
+    """原始请求体作为单张图片"""
+    try:
+        image = await read_image_body(http_request.stream())
+    except ImageIngestError as e:
+        image = e
+    yield 0, http_request.headers.get('x-filename', ''), image
+
+
+@router.post("/analyze_room/upload", response_model=AnalyzeRoomResponse)
+async def analyze_room_upload(
+    http_request: Request,
+    include_description: bool = Query(True)
+):
+    """直接上传图片进行分析(multipart多文件，或原始请求体单张图片)"""
+    request_id = str(uuid.uuid4())
+    start_time = time.time()
+    content_type = http_request.headers.get('content-type', '')
+
+    logger.info(
+        f"Starting uploaded image analysis request",
+        request_id=request_id,
+        content_type=content_type,
+        content_length=http_request.headers.get('content-length'),
+        include_description=include_description
+    )
+
+    usage = start_usage_tracking()
+
+    # multipart上传的文件数在解析前未知，默认进入bulk通道；单张图片的原始请求体进入interactive通道
+    # (均可通过通道头指定)
+    if content_type.lower().startswith('multipart/form-data'):
+        _set_scheduling_flow(http_request, None)
+        uploads = iter_multipart_images(http_request.stream(), content_type, settings.UPLOAD_MAX_FILES)
+    elif content_type.lower().startswith(('image/', 'application/octet-stream')):
+        _set_scheduling_flow(http_request, 1)
+        uploads = _single_upload(http_request)
+    else:
+        return JSONResponse(status_code=415, content={
+            'success': False,
+            'error': '请求体必须是multipart/form-data、image/*或application/octet-stream'
+        })
+
+    try:
+        results = await process_uploaded_images(uploads, include_description, request_id)
+    except UploadError as e:
+        logger.error(
+            f"Invalid upload request",
+            request_id=request_id,
+            error_message=str(e)
+        )
+        return JSONResponse(status_code=400, content={
+            'success': False,
+            'request_id': request_id,
+            'error': str(e)
+        })
+
+    if not results:
+        return JSONResponse(status_code=400, content={
+            'success': False,
+            'request_id': request_id,
+            'error': '请求中没有图片文件'
+        })
+
+    total_time = time.time() - start_time
+    logger.info(
+        f"Uploaded image processing completed",
+        request_id=request_id,
+        total_images=len(results),
+        total_duration=f"{total_time:.3f}s",
+        **usage.to_dict()
+    )
+    return {
+        'success': True,
+        'total': len(results),
+        'processing_time': f"{total_time:.3f}s",
+        'token_usage': usage.to_dict(),
+        'results': results
+    }
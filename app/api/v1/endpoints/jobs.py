@@ -0,0 +1,76 @@
+import asyncio
+from fastapi import APIRouter, Query
+from fastapi.responses import JSONResponse
+from ....schemas.requests import JobCreateRequest, JobCreateResponse, JobStatusResponse
+from ....core.config import settings
+from ....core.logging import logger
+from ....services.job_store import job_store
+from ....services.job_service import job_runner
+
+router = APIRouter()
+
+
+@router.post("/v1/jobs", response_model=JobCreateResponse, status_code=202)
+async def create_job(request: JobCreateRequest):
+    """创建异步批量分析任务，立即返回任务ID"""
+    urls = [request.url] if isinstance(request.url, str) else request.url
+
+    error_msg = None
+    if not urls:
+        error_msg = 'URL参数必须是字符串或数组'
+    elif len(urls) > settings.JOB_MAX_URLS:
+        error_msg = f'单个任务最多包含{settings.JOB_MAX_URLS}个URL'
+    else:
+        empty_urls = [i for i, url in enumerate(urls) if not url or not str(url).strip()]
+        if empty_urls:
+            error_msg = f'URL数组中的第{empty_urls}个位置包含空URL'
+    if error_msg:
+        logger.error(error_msg, urls_count=len(urls))
+        return JSONResponse(status_code=400, content={
+            'success': False,
+            'error': error_msg
+        })
+
+    job_id = await job_runner.submit(urls, request.include_description)
+    return {
+        'success': True,
+        'job_id': job_id,
+        'status': 'queued',
+        'total': len(urls)
+    }
+
+
+@router.get("/v1/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job(
+    job_id: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """查询任务进度，并按输入序号分页返回已完成的结果"""
+    job = await asyncio.to_thread(job_store.get_job, job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={
+            'success': False,
+            'error': '任务不存在或已过期'
+        })
+
+    results = await asyncio.to_thread(job_store.get_results, job_id, offset, limit)
+    completed = job['succeeded'] + job['failed']
+    return {
+        'success': True,
+        'job_id': job_id,
+        'status': job['status'],
+        'include_description': bool(job['include_description']),
+        'total': job['total'],
+        'completed': completed,
+        'succeeded': job['succeeded'],
+        'failed': job['failed'],
+        'progress': round(completed / job['total'], 4) if job['total'] else 1.0,
+        'created_at': job['created_at'],
+        'updated_at': job['updated_at'],
+        'finished_at': job['finished_at'],
+        'offset': offset,
+        'limit': limit,
+        'next_offset': offset + limit if offset + limit < job['total'] else None,
+        'results': results
+    }
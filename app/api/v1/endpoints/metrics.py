@@ -0,0 +1,19 @@
+from fastapi import APIRouter
+from ....core.metrics import metrics
+from ....services.adaptive_limit import gemini_limiter
+from ....services.key_pool import gemini_key_pool
+from ....services.token_usage import usage_ledger
+from ....services.prompt_cache import prompt_cache
+
+router = APIRouter()
+
+
+@router.get("/metrics")
+async def get_metrics():
+    """获取服务运行指标"""
+    snapshot = metrics.snapshot()
+    snapshot['adaptive_concurrency'] = {'gemini': gemini_limiter.snapshot()}
+    snapshot['gemini_keys'] = gemini_key_pool.snapshot()
+    snapshot['token_usage_by_client'] = usage_ledger.snapshot()
+    snapshot['prompt_cache'] = prompt_cache.snapshot()
+    return snapshot
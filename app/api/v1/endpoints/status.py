@@ -0,0 +1,15 @@
+from fastapi import APIRouter
+from ....utils.circuit_breaker import gemini_breaker, host_breakers
+
+router = APIRouter()
+
+
+@router.get("/status")
+async def get_status():
+    """获取熔断器状态(Gemini和处于熔断/探测中的图片主机)"""
+    return {
+        'circuit_breakers': {
+            'gemini': gemini_breaker.snapshot(),
+            'download': host_breakers.snapshot()
+        }
+    }
@@ -1,7 +1,10 @@
 from fastapi import APIRouter
-from .endpoints import analyze
+from .endpoints import analyze, jobs, metrics, status
 
 api_router = APIRouter()
 
 # 包含所有端点路由
-api_router.include_router(analyze.router, tags=["图像分析"]) 
\ No newline at end of file
+api_router.include_router(analyze.router, tags=["图像分析"])
+api_router.include_router(jobs.router, tags=["批量任务"])
+api_router.include_router(metrics.router, tags=["服务监控"])
+api_router.include_router(status.router, tags=["服务监控"]) 
\ No newline at end of file
@@ -7,12 +7,133 @@ load_dotenv()
 class Settings:
     # Gemini API配置
     GEMINI_API_KEY: str = os.getenv("GEMINI_API_KEY")
+    GEMINI_API_KEYS: list = [
+        key.strip() for key in os.getenv("GEMINI_API_KEYS", os.getenv("GEMINI_API_KEY") or "").split(",") if key.strip()
+    ]
+    GEMINI_MODEL: str = os.getenv("GEMINI_MODEL", "gemini-2.0-flash-lite")
+
+    # Gemini客户端连接池配置
+    GEMINI_POOL_SIZE: int = int(os.getenv("GEMINI_POOL_SIZE", "20"))
+    GEMINI_KEEPALIVE_CONNECTIONS: int = int(os.getenv("GEMINI_KEEPALIVE_CONNECTIONS", "10"))
+    GEMINI_KEEPALIVE_EXPIRY: float = float(os.getenv("GEMINI_KEEPALIVE_EXPIRY", "60"))
+    
+    # Gemini密钥池配置: 每个密钥每分钟的请求数和token额度(0表示不限制)，返回配额错误的密钥冷却(从2秒起连续出错时加倍，最长GEMINI_KEY_COOLDOWN秒)
+    GEMINI_KEY_RPM: int = int(os.getenv("GEMINI_KEY_RPM", "0"))
+    GEMINI_KEY_TPM: int = int(os.getenv("GEMINI_KEY_TPM", "0"))
+    GEMINI_KEY_COOLDOWN: float = float(os.getenv("GEMINI_KEY_COOLDOWN", "60"))
+    GEMINI_PROMPT_TOKENS_ESTIMATE: int = int(os.getenv("GEMINI_PROMPT_TOKENS_ESTIMATE", "1200"))
+    
+    # 系统提示词上下文缓存: 请求引用缓存而不是每次内联发送提示词，剩余有效期不足REFRESH_MARGIN秒时续期；不可用时使用内联提示词
+    PROMPT_CACHE_ENABLED: bool = os.getenv("PROMPT_CACHE_ENABLED", "false").lower() == "true"
+    PROMPT_CACHE_TTL: int = int(os.getenv("PROMPT_CACHE_TTL", "3600"))
+    PROMPT_CACHE_REFRESH_MARGIN: int = int(os.getenv("PROMPT_CACHE_REFRESH_MARGIN", "600"))
+    PROMPT_CACHE_RETRY_SECONDS: int = int(os.getenv("PROMPT_CACHE_RETRY_SECONDS", "600"))
     
+    # Gemini重试和对冲配置: 429、5xx、超时和连接错误按指数退避加抖动重试；对冲请求数不超过调用数的GEMINI_HEDGE_BUDGET倍
+    GEMINI_CALL_TIMEOUT: float = float(os.getenv("GEMINI_CALL_TIMEOUT", "30"))
+    GEMINI_MAX_RETRIES: int = int(os.getenv("GEMINI_MAX_RETRIES", "3"))
+    GEMINI_RETRY_BASE_DELAY: float = float(os.getenv("GEMINI_RETRY_BASE_DELAY", "0.5"))
+    GEMINI_RETRY_MAX_DELAY: float = float(os.getenv("GEMINI_RETRY_MAX_DELAY", "8"))
+    GEMINI_HEDGE_ENABLED: bool = os.getenv("GEMINI_HEDGE_ENABLED", "false").lower() == "true"
+    GEMINI_HEDGE_BUDGET: float = float(os.getenv("GEMINI_HEDGE_BUDGET", "0.05"))
+    GEMINI_HEDGE_MIN_SAMPLES: int = int(os.getenv("GEMINI_HEDGE_MIN_SAMPLES", "20"))
+
+    # 多图打包批量分析配置(默认关闭)
+    GEMINI_BATCH_ENABLED: bool = os.getenv("GEMINI_BATCH_ENABLED", "false").lower() == "true"
+    GEMINI_BATCH_SIZE: int = int(os.getenv("GEMINI_BATCH_SIZE", "8"))
+    GEMINI_BATCH_MAX_BYTES: int = int(os.getenv("GEMINI_BATCH_MAX_BYTES", str(15 * 1024 * 1024)))
+    GEMINI_BATCH_LINGER_MS: int = int(os.getenv("GEMINI_BATCH_LINGER_MS", "50"))
+
     # 并行处理配置
     DOWNLOAD_TIMEOUT: int = int(os.getenv("DOWNLOAD_TIMEOUT", "15"))
-    MAX_CONCURRENT_DOWNLOADS: int = int(os.getenv("MAX_CONCURRENT_DOWNLOADS", "5"))
+    # 每个下载槽位可能另外占用DOWNLOAD_RESERVE_BYTES的内存预算，调大时相应调大MEMORY_BUDGET_BYTES
+    MAX_CONCURRENT_DOWNLOADS: int = int(os.getenv("MAX_CONCURRENT_DOWNLOADS", "10"))
     MAX_CONCURRENT_ANALYSIS: int = int(os.getenv("MAX_CONCURRENT_ANALYSIS", "3"))
     
+    # 自适应分析并发配置(AIMD): 以MAX_CONCURRENT_ANALYSIS为初始值，延迟健康时逐步增加，限流或延迟上升时成倍减小
+    ADAPTIVE_CONCURRENCY_ENABLED: bool = os.getenv("ADAPTIVE_CONCURRENCY_ENABLED", "true").lower() == "true"
+    ADAPTIVE_MIN_CONCURRENCY: int = int(os.getenv("ADAPTIVE_MIN_CONCURRENCY", "1"))
+    ADAPTIVE_MAX_CONCURRENCY: int = int(os.getenv("ADAPTIVE_MAX_CONCURRENCY", "20"))
+    ADAPTIVE_DECREASE_FACTOR: float = float(os.getenv("ADAPTIVE_DECREASE_FACTOR", "0.5"))
+    ADAPTIVE_LATENCY_TOLERANCE: float = float(os.getenv("ADAPTIVE_LATENCY_TOLERANCE", "2.0"))
+    
+    # 公平调度配置: 按客户端标识轮转分配下载/分析槽位，interactive和bulk通道按权重分配
+    FAIR_FLOW_HEADER: str = os.getenv("FAIR_FLOW_HEADER", "X-API-Key")
+    FAIR_LANE_HEADER: str = os.getenv("FAIR_LANE_HEADER", "X-Priority")
+    FAIR_INTERACTIVE_MAX_URLS: int = int(os.getenv("FAIR_INTERACTIVE_MAX_URLS", "5"))
+    FAIR_INTERACTIVE_WEIGHT: int = int(os.getenv("FAIR_INTERACTIVE_WEIGHT", "4"))
+    FAIR_BULK_WEIGHT: int = int(os.getenv("FAIR_BULK_WEIGHT", "1"))
+    
+    # 准入控制配置(按worker进程): 超出限制或预计无法在时间预算内完成的请求直接返回503
+    ADMISSION_MAX_BATCH_SIZE: int = int(os.getenv("ADMISSION_MAX_BATCH_SIZE", "500"))
+    ADMISSION_MAX_QUEUED_IMAGES: int = int(os.getenv("ADMISSION_MAX_QUEUED_IMAGES", "2000"))
+    # 还没有耗时样本时使用的单张图片下载和分析耗时估计(秒)
+    ADMISSION_DEFAULT_DOWNLOAD_SECONDS: float = float(os.getenv("ADMISSION_DEFAULT_DOWNLOAD_SECONDS", "0.5"))
+    ADMISSION_DEFAULT_ANALYSIS_SECONDS: float = float(os.getenv("ADMISSION_DEFAULT_ANALYSIS_SECONDS", "2.0"))
+    
+    # 请求时间预算配置(毫秒，0表示不限时)，按比例分配给排队、下载阶段，剩余时间用于分析
+    REQUEST_DEADLINE_MS: int = int(os.getenv("REQUEST_DEADLINE_MS", "120000"))
+    MAX_DEADLINE_MS: int = int(os.getenv("MAX_DEADLINE_MS", "600000"))
+    DEADLINE_QUEUE_SHARE: float = float(os.getenv("DEADLINE_QUEUE_SHARE", "0.4"))
+    DEADLINE_DOWNLOAD_SHARE: float = float(os.getenv("DEADLINE_DOWNLOAD_SHARE", "0.3"))
+    
+    # 熔断配置(Gemini和各图片主机): 最近调用的失败率或慢调用率超过阈值时熔断，直接返回错误
+    BREAKER_WINDOW_SIZE: int = int(os.getenv("BREAKER_WINDOW_SIZE", "50"))
+    BREAKER_MIN_CALLS: int = int(os.getenv("BREAKER_MIN_CALLS", "10"))
+    BREAKER_FAILURE_RATE: float = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+    BREAKER_SLOW_CALL_RATE: float = float(os.getenv("BREAKER_SLOW_CALL_RATE", "0.8"))
+    BREAKER_GEMINI_SLOW_SECONDS: float = float(os.getenv("BREAKER_GEMINI_SLOW_SECONDS", "20"))
+    BREAKER_DOWNLOAD_SLOW_SECONDS: float = float(os.getenv("BREAKER_DOWNLOAD_SLOW_SECONDS", "10"))
+    BREAKER_OPEN_SECONDS: float = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+    BREAKER_HALF_OPEN_CALLS: int = int(os.getenv("BREAKER_HALF_OPEN_CALLS", "3"))
+    BREAKER_MAX_HOSTS: int = int(os.getenv("BREAKER_MAX_HOSTS", "1000"))
+    
+    # 内存预算配置(限制同时驻留在进程内的图片数据总字节数)
+    MEMORY_BUDGET_BYTES: int = int(os.getenv("MEMORY_BUDGET_BYTES", str(200 * 1024 * 1024)))
+    DOWNLOAD_RESERVE_BYTES: int = int(os.getenv("DOWNLOAD_RESERVE_BYTES", str(2 * 1024 * 1024)))
+    
+    # 分析结果缓存配置(按图片内容哈希)
+    RESULT_CACHE_ENABLED: bool = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+    RESULT_CACHE_MAX_ENTRIES: int = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "10000"))
+    RESULT_CACHE_TTL: int = int(os.getenv("RESULT_CACHE_TTL", str(7 * 24 * 3600)))
+    RESULT_CACHE_DB_PATH: str = os.getenv("RESULT_CACHE_DB_PATH", "")
+    
+    # 图片下载连接池配置
+    DOWNLOAD_CONNECT_TIMEOUT: float = float(os.getenv("DOWNLOAD_CONNECT_TIMEOUT", "5"))
+    DOWNLOAD_READ_TIMEOUT: float = float(os.getenv("DOWNLOAD_READ_TIMEOUT", "10"))
+    DOWNLOAD_POOL_SIZE: int = int(os.getenv("DOWNLOAD_POOL_SIZE", "100"))
+    DOWNLOAD_POOL_PER_HOST: int = int(os.getenv("DOWNLOAD_POOL_PER_HOST", "10"))
+    DOWNLOAD_DNS_CACHE_TTL: int = int(os.getenv("DOWNLOAD_DNS_CACHE_TTL", "300"))
+    DOWNLOAD_KEEPALIVE_TIMEOUT: float = float(os.getenv("DOWNLOAD_KEEPALIVE_TIMEOUT", "30"))
+    DOWNLOAD_CHUNK_SIZE: int = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(64 * 1024)))
+    MAX_IMAGE_BYTES: int = int(os.getenv("MAX_IMAGE_BYTES", str(20 * 1024 * 1024)))
+    UPLOAD_MAX_FILES: int = int(os.getenv("UPLOAD_MAX_FILES", "100"))
+    
+    # 图片预处理配置(缩放和重新编码后再发送给Gemini，默认关闭)
+    PREPROCESS_ENABLED: bool = os.getenv("PREPROCESS_ENABLED", "false").lower() == "true"
+    PREPROCESS_MAX_EDGE: int = int(os.getenv("PREPROCESS_MAX_EDGE", "1024"))
+    PREPROCESS_FORMAT: str = os.getenv("PREPROCESS_FORMAT", "JPEG").upper()
+    PREPROCESS_QUALITY: int = int(os.getenv("PREPROCESS_QUALITY", "85"))
+    PREPROCESS_WORKERS: int = int(os.getenv("PREPROCESS_WORKERS", "2"))
+    
+    # 感知哈希近似重复检测配置(默认关闭)
+    PHASH_ENABLED: bool = os.getenv("PHASH_ENABLED", "false").lower() == "true"
+    PHASH_THRESHOLD: int = int(os.getenv("PHASH_THRESHOLD", "4"))
+    PHASH_MAX_ENTRIES: int = int(os.getenv("PHASH_MAX_ENTRIES", "1000000"))
+    
+    # URL缓存配置(条件请求重新验证)
+    URL_CACHE_ENABLED: bool = os.getenv("URL_CACHE_ENABLED", "true").lower() == "true"
+    URL_CACHE_MAX_ENTRIES: int = int(os.getenv("URL_CACHE_MAX_ENTRIES", "50000"))
+    URL_CACHE_MIN_TTL: int = int(os.getenv("URL_CACHE_MIN_TTL", "0"))
+    URL_CACHE_MAX_TTL: int = int(os.getenv("URL_CACHE_MAX_TTL", "86400"))
+    
+    # 异步批量任务配置(SQLite持久队列)
+    JOB_DB_PATH: str = os.getenv("JOB_DB_PATH", "data/jobs.db")
+    JOB_WORKERS: int = int(os.getenv("JOB_WORKERS", "10"))
+    JOB_MAX_URLS: int = int(os.getenv("JOB_MAX_URLS", "10000"))
+    JOB_RETENTION: int = int(os.getenv("JOB_RETENTION", str(7 * 24 * 3600)))
+    JOB_POLL_INTERVAL: float = float(os.getenv("JOB_POLL_INTERVAL", "5"))
+    
     # 应用配置
     APP_TITLE: str = "图片房间分类服务"
     APP_DESCRIPTION: str = "使用Gemini AI分析图片是否为房间并识别房间类型"
@@ -32,5 +153,7 @@ class Settings:
 settings = Settings()
 
 # 验证配置
-if not settings.GEMINI_API_KEY:
-    raise ValueError("请设置环境变量 GEMINI_API_KEY") 
\ No newline at end of file
+if not settings.GEMINI_API_KEYS:
+    raise ValueError("请设置环境变量 GEMINI_API_KEY 或 GEMINI_API_KEYS")
+if settings.PREPROCESS_FORMAT not in ("JPEG", "WEBP"):
+    raise ValueError("PREPROCESS_FORMAT 只支持 JPEG 或 WEBP") 
\ No newline at end of file
@@ -0,0 +1,99 @@
+import threading
+from collections import defaultdict, deque
+
+
+def _metric_key(name, labels):
+    """生成带标签的指标名，如 gemini_parse_total{outcome=ok}"""
+    if not labels:
+        return name
+    label_str = ",".join(f"{key}={labels[key]}" for key in sorted(labels))
+    return f"{name}{{{label_str}}}"
+
+
+class Metrics:
+    """进程内指标收集(计数器、当前值和耗时分布)"""
+
+    def __init__(self, sample_size=1024):
+        self._lock = threading.Lock()
+        self._sample_size = sample_size
+        self._counters = defaultdict(int)
+        self._gauges = {}
+        self._samples = {}
+
+    def increment(self, name, value=1, **labels):
+        """计数器累加"""
+        key = _metric_key(name, labels)
+        with self._lock:
+            self._counters[key] += value
+
+    def set_gauge(self, name, value, **labels):
+        """设置当前值"""
+        key = _metric_key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        """记录一次观测值(保留最近的样本用于计算分位数)"""
+        key = _metric_key(name, labels)
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=self._sample_size)
+            samples.append(value)
+
+    def get_counter(self, name, **labels):
+        with self._lock:
+            return self._counters.get(_metric_key(name, labels), 0)
+
+    def sample_count(self, name, **labels):
+        """最近保留的样本数"""
+        with self._lock:
+            return len(self._samples.get(_metric_key(name, labels), ()))
+
+    def percentile(self, name, quantile, **labels):
+        """计算最近样本的分位数，没有样本时返回None"""
+        with self._lock:
+            samples = list(self._samples.get(_metric_key(name, labels), ()))
+        if not samples:
+            return None
+        samples.sort()
+        index = min(len(samples) - 1, int(quantile * len(samples)))
+        return samples[index]
+
+    def mean(self, name, **labels):
+        """计算最近样本的平均值，没有样本时返回None"""
+        with self._lock:
+            samples = self._samples.get(_metric_key(name, labels))
+            if not samples:
+                return None
+            return sum(samples) / len(samples)
+
+    def snapshot(self):
+        """导出全部指标"""
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            samples = {key: sorted(values) for key, values in self._samples.items()}
+
+        summaries = {}
+        for key, values in samples.items():
+            if not values:
+                continue
+            count = len(values)
+            summaries[key] = {
+                'count': count,
+                'avg': round(sum(values) / count, 4),
+                'p50': values[min(count - 1, int(0.50 * count))],
+                'p95': values[min(count - 1, int(0.95 * count))],
+                'p99': values[min(count - 1, int(0.99 * count))],
+                'max': values[-1]
+            }
+        return {
+            'counters': counters,
+            'gauges': gauges,
+            'summaries': summaries
+        }
+
+
+# 创建全局指标实例
+metrics = Metrics()
@@ -1,15 +1,41 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from .core.config import settings
 from .core.logging import logger
 from .core.middleware import RequestTrackingMiddleware
 from .api.v1.router import api_router
+from .services.gemini_client import gemini_client_manager
+from .services.prompt_cache import prompt_cache
+from .services.result_cache import result_cache
+from .services.preprocess_service import image_preprocessor
+from .services.job_service import job_runner
+from .utils.image_utils import get_download_session, close_download_session
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期: 启动时创建共享资源，关闭时释放"""
+    gemini_client_manager.start()
+    get_download_session()
+    if settings.PREPROCESS_ENABLED or settings.PHASH_ENABLED:
+        image_preprocessor.start()
+    await job_runner.start()
+    yield
+    await job_runner.close()
+    image_preprocessor.close()
+    await close_download_session()
+    prompt_cache.close()
+    await gemini_client_manager.close()
+    result_cache.close()
+
 
 # 初始化FastAPI应用
 app = FastAPI(
     title=settings.APP_TITLE,
     description=settings.APP_DESCRIPTION,
-    version=settings.APP_VERSION
+    version=settings.APP_VERSION,
+    lifespan=lifespan
 )
 
 # 添加请求跟踪中间件 - 暂时禁用，基本功能已工作
@@ -2,10 +2,19 @@ from pydantic import BaseModel
 from typing import List, Union, Optional, Dict, Any
 
 
+# 支持的房间类型
+ROOM_TYPES = [
+    "客厅", "家庭室", "餐厅", "厨房", "主卧室", "卧室", "客房", "卫生间", "浴室",
+    "书房", "家庭办公室", "洗衣房", "储藏室", "食品储藏间", "玄关", "门厅", "走廊",
+    "阳台", "地下室", "阁楼", "健身房", "家庭影院", "游戏室", "娱乐室", "其他"
+]
+
 class AnalyzeRoomRequest(BaseModel):
     """房间分析请求模型"""
     url: Union[str, List[str]]
     include_description: Optional[bool] = True
+    stream: Optional[bool] = False
+    deadline_ms: Optional[int] = None
 
 
 class RoomDescription(BaseModel):
@@ -22,18 +31,91 @@ class AnalyzeResult(BaseModel):
     success: bool
     is_room: Optional[bool] = None
     description: Optional[RoomDescription] = None
+    cache_hit: Optional[bool] = None
+    near_duplicate: Optional[bool] = None
+    duplicate_distance: Optional[int] = None
+    coalesced: Optional[bool] = None
+    timed_out: Optional[bool] = None
     error: Optional[str] = None
 
 
+class AnalyzeStreamResult(AnalyzeResult):
+    """流式响应中的单个结果(按完成顺序发送)"""
+    type: str = "result"
+    index: int
+
+
+class TokenUsage(BaseModel):
+    """本次请求消耗的Gemini token(缓存命中的图片不计；批量调用按图片数分摊)"""
+    input_tokens: int
+    output_tokens: int
+    total_tokens: int
+    calls: float
+
+
+class AnalyzeStreamSummary(BaseModel):
+    """流式响应的最后一条汇总记录"""
+    type: str = "summary"
+    success: bool
+    total: int
+    succeeded: int
+    failed: int
+    timed_out: int
+    processing_time: str
+    token_usage: Optional[TokenUsage] = None
+    request_id: str
+
+
 class AnalyzeRoomResponse(BaseModel):
     """房间分析响应模型"""
     success: bool
     total: Optional[int] = None
+    timed_out: Optional[int] = None
     processing_time: Optional[str] = None
+    token_usage: Optional[TokenUsage] = None
     results: Optional[List[AnalyzeResult]] = None
     error: Optional[str] = None
     error_type: Optional[str] = None
     request_id: Optional[str] = None
 
 
- 
\ No newline at end of file
+ 
+
+class JobCreateRequest(BaseModel):
+    """异步批量任务请求模型"""
+    url: Union[str, List[str]]
+    include_description: Optional[bool] = True
+
+
+class JobCreateResponse(BaseModel):
+    """异步批量任务创建响应模型"""
+    success: bool
+    job_id: Optional[str] = None
+    status: Optional[str] = None
+    total: Optional[int] = None
+    error: Optional[str] = None
+
+
+class JobResult(AnalyzeResult):
+    """任务中单个图片的结果(index为其在请求中的位置)"""
+    index: int
+
+
+class JobStatusResponse(BaseModel):
+    """异步批量任务状态和分页结果模型"""
+    success: bool
+    job_id: str
+    status: str
+    include_description: bool
+    total: int
+    completed: int
+    succeeded: int
+    failed: int
+    progress: float
+    created_at: float
+    updated_at: float
+    finished_at: Optional[float] = None
+    offset: int
+    limit: int
+    next_offset: Optional[int] = None
+    results: List[JobResult]
@@ -0,0 +1,130 @@
+import time
+from collections import deque
+from ..core.logging import logger
+from ..core.config import settings
+from ..core.metrics import metrics
+
+
+# 延迟的快/慢指数移动平均系数: 快速值反映当前延迟，慢速值作为健康时的基线
+FAST_ALPHA = 0.3
+SLOW_ALPHA = 0.05
+
+# 调整记录保留条数
+HISTORY_SIZE = 100
+
+
+def is_overload_error(error):
+    """Gemini返回限流或过载(429/503/RESOURCE_EXHAUSTED/UNAVAILABLE)"""
+    code = getattr(error, 'code', None)
+    status = str(getattr(error, 'status', '') or '')
+    if code in (429, 503) or status in ('RESOURCE_EXHAUSTED', 'UNAVAILABLE'):
+        return True
+    return 'RESOURCE_EXHAUSTED' in str(error)
+
+
+class AIMDLimiter:
+    """加性增、乘性减(AIMD)的并发上限
+
+    每个健康的调用使上限增加 1/limit (约每轮增加1)；遇到限流/过载错误或当前延迟超过基线的
+    tolerance倍时上限乘以decrease_factor。一个延迟周期内最多下调一次，避免同一波错误连续下调。
+    """
+
+    def __init__(self, name, initial, min_limit, max_limit, decrease_factor, latency_tolerance):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self._limit = float(min(max(initial, min_limit), max_limit))
+        self._fast_latency = None
+        self._baseline_latency = None
+        self._last_decrease = 0.0
+        self._listeners = []
+        self.history = deque(maxlen=HISTORY_SIZE)
+        metrics.set_gauge('concurrency_limit', self.limit, limiter=self.name)
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def add_listener(self, callback):
+        """上限变化时调用callback(新上限)，注册时立即以当前上限调用一次"""
+        self._listeners.append(callback)
+        callback(self.limit)
+
+    def on_success(self, latency):
+        """记录一次成功调用的延迟"""
+        if self._fast_latency is None:
+            self._fast_latency = self._baseline_latency = latency
+        else:
+            self._fast_latency += FAST_ALPHA * (latency - self._fast_latency)
+
+        if self._fast_latency > self._baseline_latency * self.latency_tolerance:
+            self._decrease('latency')
+            return
+
+        self._baseline_latency += SLOW_ALPHA * (latency - self._baseline_latency)
+        self._set_limit(self._limit + 1 / max(self._limit, 1), 'healthy')
+
+    def on_overload(self):
+        """记录一次限流/过载错误"""
+        self._decrease('overload')
+
+    def _decrease(self, reason):
+        now = time.monotonic()
+        if now - self._last_decrease < (self._fast_latency or 0):
+            return
+        self._last_decrease = now
+        self._set_limit(self._limit * self.decrease_factor, reason)
+        if reason == 'latency':
+            # 以当前延迟重新作为基线，避免持续高延迟时反复下调到最小值
+            self._baseline_latency = self._fast_latency
+
+    def _set_limit(self, value, reason):
+        value = min(max(value, self.min_limit), self.max_limit)
+        old_limit = self.limit
+        self._limit = value
+        if self.limit == old_limit:
+            return
+
+        direction = 'increase' if self.limit > old_limit else 'decrease'
+        metrics.increment('concurrency_adjustments_total', limiter=self.name, direction=direction, reason=reason)
+        metrics.set_gauge('concurrency_limit', self.limit, limiter=self.name)
+        self.history.append({
+            'time': time.time(),
+            'from': old_limit,
+            'to': self.limit,
+            'reason': reason
+        })
+        log = logger.warning if direction == 'decrease' else logger.debug
+        log(
+            f"Concurrency limit adjusted",
+            limiter=self.name,
+            old_limit=old_limit,
+            new_limit=self.limit,
+            reason=reason,
+            latency=f"{self._fast_latency:.3f}s" if self._fast_latency is not None else None
+        )
+        for callback in self._listeners:
+            callback(self.limit)
+
+    def snapshot(self):
+        return {
+            'limit': self.limit,
+            'min_limit': self.min_limit,
+            'max_limit': self.max_limit,
+            'latency': self._fast_latency,
+            'baseline_latency': self._baseline_latency,
+            'history': list(self.history)
+        }
+
+
+# 创建全局Gemini并发上限(未启用自适应时上下限相同，即固定为MAX_CONCURRENT_ANALYSIS)
+gemini_limiter = AIMDLimiter(
+    'gemini',
+    initial=settings.MAX_CONCURRENT_ANALYSIS,
+    min_limit=settings.ADAPTIVE_MIN_CONCURRENCY if settings.ADAPTIVE_CONCURRENCY_ENABLED else settings.MAX_CONCURRENT_ANALYSIS,
+    max_limit=settings.ADAPTIVE_MAX_CONCURRENCY if settings.ADAPTIVE_CONCURRENCY_ENABLED else settings.MAX_CONCURRENT_ANALYSIS,
+    decrease_factor=settings.ADAPTIVE_DECREASE_FACTOR,
+    latency_tolerance=settings.ADAPTIVE_LATENCY_TOLERANCE
+)
@@ -0,0 +1,141 @@
+import math
+from ..core.config import settings
+from ..core.metrics import metrics
+from .scheduler import LANES, LANE_WEIGHTS
+from .image_service import download_scheduler, analysis_scheduler
+
+
+# 还没有耗时样本时使用的各阶段单张图片耗时估计(秒)
+DEFAULT_STAGE_SECONDS = {
+    'download': settings.ADMISSION_DEFAULT_DOWNLOAD_SECONDS,
+    'analysis': settings.ADMISSION_DEFAULT_ANALYSIS_SECONDS
+}
+
+
+class AdmissionRejected(Exception):
+    """请求被准入控制拒绝"""
+
+    def __init__(self, message, status_code, retry_after=None, reason='overloaded'):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionTicket:
+    """已接纳的图片数，每完成一张归还一张"""
+
+    def __init__(self, controller, lane, count):
+        self._controller = controller
+        self.lane = lane
+        self.remaining = count
+
+    def release(self, count=1):
+        count = min(count, self.remaining)
+        if count > 0:
+            self.remaining -= count
+            self._controller._release(self.lane, count)
+
+    def close(self):
+        self.release(self.remaining)
+
+
+class AdmissionController:
+    """在处理前根据排队深度和近期各阶段耗时估计等待时间，无法在截止时间内完成时直接拒绝
+
+    估计方法: 每个阶段的完成时间约为(同通道排队的图片数 + 本次图片数) / 本通道可用槽位 × 单张平均耗时
+    (不少于一张图片的耗时)，流水线整体取最慢的阶段，再加上其余阶段各一张图片的耗时(流水线填充)。
+    同通道没有图片在处理时不按估计拒绝: 空闲的服务无论估计多少都应该尝试处理。
+    """
+
+    def __init__(self, download_scheduler, analysis_scheduler):
+        self._stages = {
+            'download': download_scheduler,
+            'analysis': analysis_scheduler
+        }
+        self.in_system = {lane: 0 for lane in LANES}
+
+    @property
+    def total_in_system(self):
+        return sum(self.in_system.values())
+
+    def estimate_seconds(self, count, lane):
+        """估计本通道新加入count张图片全部完成所需的时间(秒)"""
+        depth = self.in_system[lane] + count
+        service_times = {stage: self.service_time(stage) for stage in self._stages}
+        latency = sum(service_times.values())
+        estimate = 0.0
+        for stage, scheduler in self._stages.items():
+            # 该阶段处理完所有图片的时间已包含它自己的一张图片耗时，只加上其余阶段的
+            waves = max(depth / self._lane_capacity(scheduler, lane), 1.0)
+            estimate = max(estimate, waves * service_times[stage] + latency - service_times[stage])
+        return estimate
+
+    def service_time(self, stage):
+        value = metrics.mean('stage_seconds', stage=stage)
+        return value if value is not None else DEFAULT_STAGE_SECONDS[stage]
+
+    def _lane_capacity(self, scheduler, lane):
+        """其他通道也有排队时，本通道只能获得按权重分配的那部分槽位"""
+        others_busy = any(
+            scheduler.lane_waiting(other) or self.in_system[other]
+            for other in LANES if other != lane
+        )
+        if not others_busy:
+            return scheduler.capacity
+        share = LANE_WEIGHTS[lane] / sum(LANE_WEIGHTS.values())
+        return max(scheduler.capacity * share, 1e-9)
+
+    def admit(self, count, lane, deadline=None):
+        """接纳count张图片，返回AdmissionTicket；拒绝时抛出AdmissionRejected"""
+        if count > settings.ADMISSION_MAX_BATCH_SIZE:
+            self._reject('batch_too_large', lane)
+            raise AdmissionRejected(
+                f'单次请求最多包含{settings.ADMISSION_MAX_BATCH_SIZE}张图片，更大的批次请使用 /v1/jobs',
+                status_code=413,
+                reason='batch_too_large'
+            )
+
+        if self.total_in_system + count > settings.ADMISSION_MAX_QUEUED_IMAGES:
+            self._reject('queue_full', lane)
+            raise AdmissionRejected(
+                f'服务繁忙: 排队图片数已达上限({settings.ADMISSION_MAX_QUEUED_IMAGES})，请稍后重试',
+                status_code=503,
+                retry_after=self._retry_after(self.estimate_seconds(0, lane)),
+                reason='queue_full'
+            )
+
+        estimate = self.estimate_seconds(count, lane)
+        metrics.observe('admission_estimated_seconds', estimate, lane=lane)
+        if deadline is not None and self.in_system[lane] and estimate > deadline.remaining():
+            self._reject('deadline', lane)
+            raise AdmissionRejected(
+                f'服务繁忙: 预计需要{estimate:.1f}秒，无法在时间预算({deadline.timeout:.1f}秒)内完成，请稍后重试',
+                status_code=503,
+                retry_after=self._retry_after(estimate - deadline.remaining()),
+                reason='deadline'
+            )
+
+        self.in_system[lane] += count
+        self._update_gauges(lane)
+        metrics.increment('admission_total', result='accepted', lane=lane)
+        return AdmissionTicket(self, lane, count)
+
+    def _release(self, lane, count):
+        self.in_system[lane] -= count
+        self._update_gauges(lane)
+
+    @staticmethod
+    def _retry_after(seconds):
+        return max(1, math.ceil(seconds))
+
+    @staticmethod
+    def _reject(reason, lane):
+        metrics.increment('admission_total', result=reason, lane=lane)
+
+    def _update_gauges(self, lane):
+        metrics.set_gauge('admission_in_system', self.in_system[lane], lane=lane)
+
+
+# 创建全局准入控制器(按worker进程统计)
+admission_controller = AdmissionController(download_scheduler, analysis_scheduler)
@@ -0,0 +1,219 @@
+import asyncio
+import contextvars
+import json
+import time
+import traceback
+from google.genai import types
+from ..core.logging import logger
+from ..core.config import settings
+from ..core.metrics import metrics
+from .gemini_client import gemini_client_manager
+from .gemini_service import (
+    analyze_image_with_gemini_async,
+    build_image_part,
+    generate_content_async,
+    validate_result_json
+)
+from .adaptive_limit import gemini_limiter
+from .scheduler import FairScheduler, LANE_WEIGHTS
+from .token_usage import estimate_call_tokens, usage_ledger, current_usage
+
+
+class _BatchItem:
+    """等待批量分析的单张图片"""
+
+    def __init__(self, image_data, mime_type, url, request_id, future):
+        self.image_data = image_data
+        self.mime_type = mime_type
+        self.url = url
+        self.request_id = request_id
+        self.future = future
+        self.size = len(image_data) if image_data else 0
+        # 提交者的上下文(调度身份和请求用量)，用于分摊用量和单独重试
+        self.context = contextvars.copy_context()
+
+
+def parse_batch_response(result_text, count, include_description):
+    """解析批量响应中的JSON数组，返回{index: (is_room, description)}，缺失或格式错误的项不包含在内"""
+    try:
+        items = json.loads(result_text) if result_text.strip() else None
+    except json.JSONDecodeError:
+        items = None
+    if not isinstance(items, list):
+        metrics.increment('gemini_parse_total', value=count, outcome='invalid_batch')
+        return {}
+
+    results = {}
+    for item in items:
+        index = item.get('index') if isinstance(item, dict) else None
+        if not isinstance(index, int) or isinstance(index, bool) or not 0 <= index < count:
+            continue
+        try:
+            results[index] = validate_result_json(item, include_description)
+        except ValueError:
+            continue
+
+    metrics.increment('gemini_parse_total', value=len(results), outcome='ok')
+    if len(results) < count:
+        metrics.increment('gemini_parse_total', value=count - len(results), outcome='batch_item_missing')
+    return results
+
+
+class GeminiBatcher:
+    """把并发到达的多张图片打包到一次Gemini请求中分析"""
+
+    def __init__(self):
+        self._pending = {True: [], False: []}
+        self._pending_bytes = {True: 0, False: 0}
+        self._timers = {}
+        self._tasks = set()
+        # 同时进行的批量请求数，跟随自适应并发上限调整
+        self._slots = FairScheduler('gemini_batch', gemini_limiter.limit, LANE_WEIGHTS)
+        gemini_limiter.add_listener(self._slots.set_capacity)
+
+    async def analyze(self, image_data, mime_type, include_description=True, url=None, request_id='unknown'):
+        """提交图片等待批量分析，返回(is_room, description)"""
+        mode = bool(include_description)
+        loop = asyncio.get_running_loop()
+        item = _BatchItem(image_data, mime_type, url, request_id, loop.create_future())
+
+        # 超出字节预算时先发送已排队的图片
+        pending = self._pending[mode]
+        if pending and self._pending_bytes[mode] + item.size > settings.GEMINI_BATCH_MAX_BYTES:
+            self._flush(mode)
+
+        self._pending[mode].append(item)
+        self._pending_bytes[mode] += item.size
+
+        if (len(self._pending[mode]) >= settings.GEMINI_BATCH_SIZE
+                or self._pending_bytes[mode] >= settings.GEMINI_BATCH_MAX_BYTES):
+            self._flush(mode)
+        elif mode not in self._timers:
+            self._timers[mode] = loop.call_later(
+                settings.GEMINI_BATCH_LINGER_MS / 1000, self._flush, mode
+            )
+
+        return await item.future
+
+    def _flush(self, mode):
+        """取出当前排队的图片并启动批量请求"""
+        timer = self._timers.pop(mode, None)
+        if timer is not None:
+            timer.cancel()
+
+        items = self._pending[mode]
+        if not items:
+            return
+        self._pending[mode] = []
+        self._pending_bytes[mode] = 0
+
+        task = asyncio.ensure_future(self._run_batch(items, mode))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, items, mode):
+        """执行一次批量请求，并把结果分发给各图片"""
+        async with self._slots.slot():
+            # 等待期间调用方已放弃(如超出请求时间预算)的图片不再发送
+            items = [item for item in items if not item.future.done()]
+            if not items:
+                return
+            if len(items) == 1:
+                await self._analyze_single(items[0], mode)
+                return
+
+            request_ids = sorted({item.request_id for item in items})
+            start_time = time.time()
+            logger.info(
+                f"Sending batched request to Gemini API",
+                request_id=request_ids[0],
+                request_ids=request_ids,
+                batch_size=len(items),
+                data_size=sum(item.size for item in items),
+                include_description=mode
+            )
+
+            try:
+                parts = []
+                for index, item in enumerate(items):
+                    parts.append(types.Part.from_text(text=f"Image index: {index}"))
+                    parts.append(build_image_part(item.image_data, item.mime_type, item.url, item.request_id))
+
+                response = await generate_content_async(
+                    settings.GEMINI_MODEL,
+                    types.Content(role="user", parts=parts),
+                    gemini_client_manager.get_batch_config(mode),
+                    call='batch',
+                    estimated_tokens=estimate_call_tokens(item.image_data for item in items),
+                    request_id=request_ids[0]
+                )
+            except Exception as e:
+                logger.error(
+                    f"Batched Gemini analysis failed with exception",
+                    request_id=request_ids[0],
+                    request_ids=request_ids,
+                    batch_size=len(items),
+                    error_type=type(e).__name__,
+                    error_message=str(e),
+                    stack_trace=traceback.format_exc()
+                )
+                for item in items:
+                    if not item.future.done():
+                        item.future.set_exception(Exception(f"图片分析失败: {str(e)}"))
+                return
+
+            # 批量调用的用量按图片数平均分摊给各图片所属的请求和客户端
+            for item in items:
+                item.context.run(
+                    lambda: usage_ledger.record(response.usage_metadata, 1 / len(items), current_usage())
+                )
+
+            results = parse_batch_response(response.text or "", len(items), mode)
+            missing = [index for index in range(len(items)) if index not in results]
+
+            logger.info(
+                f"Received batched response from Gemini API",
+                request_id=request_ids[0],
+                batch_size=len(items),
+                parsed_count=len(results),
+                missing_indices=missing,
+                api_duration=f"{time.time() - start_time:.3f}s"
+            )
+
+            for index, result in results.items():
+                future = items[index].future
+                if not future.done():
+                    future.set_result(result)
+
+        # 缺失或格式错误的图片单独重试(不占用批量并发槽位)
+        if missing:
+            logger.warning(
+                f"Retrying images missing from batched response individually",
+                request_id=request_ids[0],
+                missing_count=len(missing),
+                batch_size=len(items)
+            )
+            await asyncio.gather(*(self._analyze_single(items[index], mode) for index in missing))
+
+    @staticmethod
+    async def _analyze_single(item, mode):
+        """单独分析一张图片"""
+        if item.future.done():
+            return
+        try:
+            result = await asyncio.create_task(
+                analyze_image_with_gemini_async(
+                    item.image_data, item.mime_type, mode, item.url, item.request_id
+                ),
+                context=item.context
+            )
+        except Exception as e:
+            if not item.future.done():
+                item.future.set_exception(e)
+        else:
+            if not item.future.done():
+                item.future.set_result(result)
+
+
+# 创建全局批量分析器
+gemini_batcher = GeminiBatcher()
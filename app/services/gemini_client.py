@@ -0,0 +1,117 @@
+import threading
+import httpx
+from google import genai
+from google.genai import types
+from ..core.logging import logger
+from ..core.config import settings
+from .prompts import (
+    get_system_prompt,
+    get_batch_system_prompt,
+    get_response_schema,
+    get_batch_response_schema
+)
+
+
+class GeminiClientManager:
+    """进程级Gemini客户端管理器，复用连接池和预构建的请求配置(密钥池中每个密钥一个客户端，共享连接池)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._transport = None
+        self._async_transport = None
+        self._configs = {}
+        self._batch_configs = {}
+
+    @property
+    def started(self):
+        return bool(self._clients)
+
+    def start(self):
+        """创建共享客户端(每个worker进程启动时调用一次)"""
+        with self._lock:
+            if self._clients:
+                return
+
+            limits = httpx.Limits(
+                max_connections=settings.GEMINI_POOL_SIZE,
+                max_keepalive_connections=settings.GEMINI_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.GEMINI_KEEPALIVE_EXPIRY
+            )
+            # 显式传入transport，SDK会使用带连接池的httpx客户端，而不是每次请求新建会话
+            self._transport = httpx.HTTPTransport(limits=limits)
+            self._async_transport = httpx.AsyncHTTPTransport(limits=limits)
+            http_options = types.HttpOptions(
+                client_args={'transport': self._transport},
+                async_client_args={'transport': self._async_transport}
+            )
+            self._clients = {
+                api_key: genai.Client(api_key=api_key, http_options=http_options)
+                for api_key in settings.GEMINI_API_KEYS
+            }
+            self._configs = {
+                mode: self._build_config(get_system_prompt(mode), get_response_schema(mode))
+                for mode in (True, False)
+            }
+            self._batch_configs = {
+                mode: self._build_config(get_batch_system_prompt(mode), get_batch_response_schema(mode))
+                for mode in (True, False)
+            }
+
+            logger.info(
+                f"Gemini client initialized",
+                model=settings.GEMINI_MODEL,
+                api_keys=len(self._clients),
+                pool_size=settings.GEMINI_POOL_SIZE,
+                keepalive_connections=settings.GEMINI_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.GEMINI_KEEPALIVE_EXPIRY
+            )
+
+    @staticmethod
+    def _build_config(system_prompt, response_schema):
+        """根据系统提示词和响应Schema构建JSON模式的请求配置"""
+        return types.GenerateContentConfig(
+            system_instruction=[
+                types.Part.from_text(text=system_prompt),
+            ],
+            response_mime_type="application/json",
+            response_schema=response_schema,
+        )
+
+    def get_client(self, api_key=None):
+        """获取指定密钥(默认第一个密钥)的共享客户端，未初始化时(如脚本中直接调用)自动创建"""
+        if not self._clients:
+            self.start()
+        return self._clients[api_key or settings.GEMINI_API_KEYS[0]]
+
+    def get_config(self, include_description):
+        """获取指定分析模式的预构建配置"""
+        if not self._clients:
+            self.start()
+        return self._configs[bool(include_description)]
+
+    def get_batch_config(self, include_description):
+        """获取指定分析模式的批量请求配置"""
+        if not self._clients:
+            self.start()
+        return self._batch_configs[bool(include_description)]
+
+    async def close(self):
+        """关闭客户端并释放连接池"""
+        with self._lock:
+            transport, async_transport = self._transport, self._async_transport
+            self._clients = {}
+            self._transport = None
+            self._async_transport = None
+            self._configs = {}
+            self._batch_configs = {}
+
+        if transport is not None:
+            transport.close()
+        if async_transport is not None:
+            await async_transport.aclose()
+        logger.info(f"Gemini client closed")
+
+
+# 创建全局客户端管理器
+gemini_client_manager = GeminiClientManager()
@@ -0,0 +1,67 @@
+import random
+import httpx
+from google.genai import errors
+from ..core.config import settings
+from ..core.metrics import metrics
+
+
+# 对冲预算最多积累的次数，避免长时间空闲后一次性发出大量对冲请求
+HEDGE_BURST = 10
+
+
+def retry_reason(error):
+    """可重试的错误返回原因(用于指标和日志)，不可重试时返回None"""
+    if isinstance(error, errors.APIError):
+        if error.code == 429:
+            return 'rate_limited'
+        if error.code == 408:
+            return 'timeout'
+        if error.code and error.code >= 500:
+            return 'server_error'
+        # 其余4xx(请求无效、鉴权失败等)重试也不会成功
+        return None
+    if isinstance(error, (TimeoutError, httpx.TimeoutException)):
+        return 'timeout'
+    if isinstance(error, (ConnectionError, httpx.NetworkError, httpx.RemoteProtocolError)):
+        return 'connection'
+    return None
+
+
+def backoff_delay(attempt):
+    """第attempt次重试(从0开始)前的等待时间: 指数退避 + 全抖动"""
+    ceiling = min(settings.GEMINI_RETRY_MAX_DELAY, settings.GEMINI_RETRY_BASE_DELAY * 2 ** attempt)
+    return random.uniform(0, ceiling)
+
+
+class HedgeBudget:
+    """对冲请求预算: 每次调用积累ratio次对冲额度，发出一次对冲消耗1次
+
+    对冲请求数因此不超过调用数的ratio倍，Gemini变慢时不会因为对冲把负载翻倍。
+    """
+
+    def __init__(self, ratio, burst=HEDGE_BURST):
+        self.ratio = ratio
+        self.burst = burst
+        self._tokens = 0.0
+
+    def record_call(self):
+        self._tokens = min(self.burst, self._tokens + self.ratio)
+
+    def try_acquire(self):
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+
+def hedge_delay(call):
+    """发出对冲请求前的等待时间: 该类调用最近的p95延迟，样本不足或未启用时返回None"""
+    if not settings.GEMINI_HEDGE_ENABLED:
+        return None
+    if metrics.sample_count('gemini_call_seconds', call=call) < settings.GEMINI_HEDGE_MIN_SAMPLES:
+        return None
+    return metrics.percentile('gemini_call_seconds', 0.95, call=call)
+
+
+# 创建全局对冲预算
+hedge_budget = HedgeBudget(settings.GEMINI_HEDGE_BUDGET)
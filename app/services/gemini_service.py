@@ -1,81 +1,281 @@
-import base64
+import asyncio
 import time
 import json
 import traceback
-from google import genai
-from google.genai import types
+from google.genai import types, errors
+from pydantic import ValidationError
 from ..core.logging import logger
+from ..core.metrics import metrics
 from ..core.config import settings
-from ..utils.decorators import monitor_performance
+from ..utils.decorators import monitor_performance, monitor_async_performance
 from ..utils.url_utils import ensure_valid_mime_type_for_gemini
+from ..schemas.requests import RoomDescription, ROOM_TYPES
+from .gemini_client import gemini_client_manager
+from .adaptive_limit import gemini_limiter, is_overload_error
+from .gemini_retry import retry_reason, backoff_delay, hedge_budget, hedge_delay
+from ..utils.circuit_breaker import gemini_breaker
+from .key_pool import gemini_key_pool
+from .token_usage import estimate_call_tokens, usage_ledger, current_usage
+from .prompt_cache import prompt_cache, is_cache_rejection
 
 
-@monitor_performance("Gemini Image Analysis")
-def analyze_image_with_gemini(image_data, mime_type, include_description=True, url=None, request_id='unknown'):
-    """使用Gemini AI分析图片"""
-    try:
+def _log_analysis_start(image_data, mime_type, include_description, url, request_id):
+    """记录分析开始日志"""
+    logger.info(
+        f"Starting Gemini image analysis",
+        request_id=request_id,
+        url=url,
+        mime_type=mime_type,
+        include_description=include_description,
+        data_size=len(image_data) if image_data else 0
+    )
+
+
+def build_image_part(image_data, mime_type, url=None, request_id='unknown'):
+    """构建Gemini图片请求片段，image_data为原始图片字节"""
+    # 确保MIME类型是Gemini API支持的格式
+    safe_mime_type = ensure_valid_mime_type_for_gemini(mime_type, url, request_id)
+    if safe_mime_type != mime_type:
         logger.info(
-            f"Starting Gemini image analysis",
+            f"MIME type converted for Gemini API compatibility",
             request_id=request_id,
-            url=url,
-            mime_type=mime_type,
-            include_description=include_description,
-            data_size=len(image_data) if image_data else 0
+            original_mime_type=mime_type,
+            converted_mime_type=safe_mime_type
         )
-        
-        start_time = time.time()
-        # 确保MIME类型是Gemini API支持的格式
-        safe_mime_type = ensure_valid_mime_type_for_gemini(mime_type, url, request_id)
-        if safe_mime_type != mime_type:
-            logger.info(
-                f"MIME type converted for Gemini API compatibility",
-                request_id=request_id,
-                original_mime_type=mime_type,
-                converted_mime_type=safe_mime_type
-            )
 
-        logger.debug(
-            f"Initializing Gemini client",
-            request_id=request_id
-        )
-        
-        client = genai.Client(api_key=settings.GEMINI_API_KEY)
-        model = "gemini-2.0-flash-lite"
-        
-        logger.debug(
-            f"Using Gemini model: {model}",
-            request_id=request_id,
-            model=model
+    logger.debug(
+        f"Preparing API request content",
+        request_id=request_id,
+        mime_type=safe_mime_type,
+        image_data_length=len(image_data)
+    )
+
+    # 直接传入原始字节，base64编码只在SDK序列化请求时进行一次
+    return types.Part.from_bytes(
+        mime_type=safe_mime_type,
+        data=bytes(image_data)
+    )
+
+
+def validate_result_json(result_json, include_description):
+    """校验单张图片的结果JSON，返回(is_room, description)，格式不符时抛出ValueError"""
+    if not isinstance(result_json, dict):
+        raise ValueError("响应不是JSON对象")
+
+    is_room = result_json.get('is_room')
+    if not isinstance(is_room, bool):
+        raise ValueError("JSON格式不完整: 缺少is_room字段")
+    if not include_description:
+        return is_room, {}
+
+    try:
+        description = RoomDescription(
+            **{field_name: result_json.get(field_name) for field_name in RoomDescription.model_fields}
         )
-        
-        if include_description:
-            system_prompt = """Analyze the provided image and determine if it is a room, then provide a structured description.\n\nDefinition:\nA \"room\" is defined as an interior space within a building, intended for human occupancy or activity.\n\nRoom Types:\n[\"客厅\", \"家庭室\", \"餐厅\", \"厨房\", \"主卧室\", \"卧室\", \"客房\", \"卫生间\", \"浴室\", \"书房\", \"家庭办公室\", \"洗衣房\", \"储藏室\", \"食品储藏间\", \"玄关\", \"门厅\", \"走廊\", \"阳台\", \"地下室\", \"阁楼\", \"健身房\", \"家庭影院\", \"游戏室\", \"娱乐室\", \"其他\"]\n\nRules:\n1. Analyze the content of the image carefully.\n2. Determine if the image matches the definition of a \"room\".\n3. If it's a room, identify the room type from the list above.\n4. You MUST return ONLY a valid JSON object in the following format:\n{\n    \"is_room\": true/false,\n    \"room_type\": \"房型名称（从列表中选一个）\",\n    \"basic_info\": \"基本信息：精炼描述整体风格与布局\",\n    \"features\": \"特点：用最精炼的语言一句话描述最显著特点\"\n}\n\nDescription Guidelines:\n- room_type: 必须从提供的房型列表中选择一个，如果不匹配任何类型则选择\"其他\"\n- basic_info: 侧重整体风格与布局，用精炼语言描述\n- features: 用一句话描述最显著的特点\n\nIMPORTANT: Return ONLY the JSON object, no other text or explanation."""
-            logger.debug("Using detailed analysis prompt", request_id=request_id)
-        else:
-            system_prompt = """Analyze the provided image and determine if it is a room.\n\nDefinition:\nA \"room\" is defined as an interior space within a building, intended for human occupancy or activity.\n\nRules:\n1. Analyze the content of the image carefully.\n2. Determine if the image matches the definition of a \"room\".\n3. You MUST return ONLY a valid JSON object in the following format:\n{\n    \"is_room\": true/false\n}\n\nIMPORTANT: Return ONLY the JSON object, no other text or explanation."""
-            logger.debug("Using basic analysis prompt", request_id=request_id)
-        
-        logger.debug(
-            f"Preparing API request content",
+    except ValidationError as e:
+        raise ValueError(f"房间描述字段无效: {e.error_count()}个错误")
+    if description.room_type not in ROOM_TYPES:
+        raise ValueError(f"未知的房间类型: {description.room_type}")
+    return is_room, description.model_dump()
+
+
+def _prepare_request(image_data, mime_type, include_description, url, request_id):
+    """准备Gemini请求内容和配置，返回(model, content, config)"""
+    model = settings.GEMINI_MODEL
+    generate_content_config = gemini_client_manager.get_config(include_description)
+    
+    logger.debug(
+        f"Using Gemini model: {model}",
+        request_id=request_id,
+        model=model,
+        include_description=include_description
+    )
+    
+    content = types.Content(
+        role="user",
+        parts=[build_image_part(image_data, mime_type, url, request_id)],
+    )
+    return model, content, generate_content_config
+
+
+def parse_gemini_response(response, include_description, request_id='unknown', start_time=None):
+    """一次性解析并校验Gemini的JSON模式响应，返回(is_room, description)"""
+    if start_time is None:
+        start_time = time.time()
+
+    result_text = response.text or ""
+    outcome = "empty"
+    try:
+        if not result_text.strip():
+            raise ValueError("Gemini返回空响应")
+        outcome = "invalid_json"
+        result_json = json.loads(result_text)
+        outcome = "schema_mismatch"
+        is_room, description = validate_result_json(result_json, include_description)
+    except ValueError as e:
+        # json.JSONDecodeError是ValueError的子类
+        metrics.increment('gemini_parse_total', outcome=outcome)
+        logger.warning(
+            f"Gemini response failed validation",
             request_id=request_id,
-            mime_type=safe_mime_type,
-            image_data_length=len(image_data)
-        )
-        
-        content = types.Content(
-            role="user",
-            parts=[
-                types.Part.from_bytes(
-                    mime_type=safe_mime_type,
-                    data=base64.b64decode(image_data)
-                ),
-            ],
+            parsing_outcome=outcome,
+            error_type=type(e).__name__,
+            raw_response=result_text[:300] + "..." if len(result_text) > 300 else result_text
         )
-        generate_content_config = types.GenerateContentConfig(
-            system_instruction=[
-                types.Part.from_text(text=system_prompt),
-            ],
-            response_mime_type="text/plain",
+        raise ValueError(f"Gemini响应格式无效: {str(e)}")
+
+    metrics.increment('gemini_parse_total', outcome='ok')
+    analysis_time = time.time() - start_time
+
+    logger.info(
+        f"Successfully parsed Gemini response",
+        request_id=request_id,
+        is_room=is_room,
+        room_type=description.get('room_type') if include_description else None,
+        analysis_duration=f"{analysis_time:.3f}s",
+        parsing_method="json_schema"
+    )
+    return is_room, description
+
+
+def _log_analysis_failure(e, request_id):
+    """记录分析失败日志"""
+    logger.error(
+        f"Gemini analysis failed with exception",
+        request_id=request_id,
+        error_type=type(e).__name__,
+        error_message=str(e),
+        stack_trace=traceback.format_exc()
+    )
+
+
+async def _generate_with_prompt_cache(api_key, model, contents, config):
+    """启用提示词缓存时引用缓存发送请求，缓存被拒绝(如已过期删除)时改用内联提示词重发
+
+    其他错误(如图片无法解码)与缓存无关，直接抛出，不重发也不丢弃缓存
+    """
+    models = gemini_client_manager.get_client(api_key).aio.models
+    request_config = prompt_cache.resolve(api_key, config) if settings.PROMPT_CACHE_ENABLED else config
+    try:
+        return await models.generate_content(model=model, contents=contents, config=request_config)
+    except errors.ClientError as e:
+        if request_config is config or not is_cache_rejection(e):
+            raise
+        prompt_cache.invalidate(api_key, config, e)
+        return await models.generate_content(model=model, contents=contents, config=config)
+
+
+def _total_tokens(response):
+    """响应中的实际token用量(输入+输出)，没有用量信息时返回None"""
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is None:
+        return None
+    return (usage.prompt_token_count or 0) + (usage.candidates_token_count or 0)
+
+
+async def _generate_once(model, contents, config, call, estimated_tokens):
+    """调用一次Gemini异步接口(带超时和熔断)，并把延迟和限流/过载错误反馈给自适应并发上限"""
+    # 先在本地排队等待密钥额度，等待时间不计入调用延迟
+    key = await gemini_key_pool.acquire(estimated_tokens)
+    start_time = time.perf_counter()
+    response = None
+    sent = False
+    quota_exceeded = False
+    try:
+        async with gemini_breaker.guard(lambda e: retry_reason(e) is not None):
+            sent = True
+            async with asyncio.timeout(settings.GEMINI_CALL_TIMEOUT):
+                response = await _generate_with_prompt_cache(key.api_key, model, contents, config)
+    except TimeoutError:
+        # 超时说明Gemini已明显变慢，按过载处理
+        gemini_limiter.on_overload()
+        raise TimeoutError(f"Gemini请求超时({settings.GEMINI_CALL_TIMEOUT}秒)") from None
+    except Exception as e:
+        quota_exceeded = retry_reason(e) == 'rate_limited'
+        if is_overload_error(e):
+            gemini_limiter.on_overload()
+        raise
+    finally:
+        gemini_key_pool.release(key, quota_exceeded, estimated_tokens, _total_tokens(response), sent)
+    latency = time.perf_counter() - start_time
+    metrics.observe('gemini_call_seconds', latency, call=call)
+    gemini_limiter.on_success(latency)
+    return response
+
+
+async def _generate_hedged(model, contents, config, call, estimated_tokens, request_id):
+    """超过近期p95延迟仍未返回时(在对冲预算内)再发一个相同请求，取先成功的结果"""
+    hedge_budget.record_call()
+    primary = asyncio.ensure_future(_generate_once(model, contents, config, call, estimated_tokens))
+    tasks = {primary}
+    try:
+        delay = hedge_delay(call)
+        if delay is not None:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and hedge_budget.try_acquire():
+                metrics.increment('gemini_hedges_total', call=call, result='sent')
+                logger.info(
+                    f"Sending hedged request to Gemini API",
+                    request_id=request_id,
+                    call=call,
+                    hedge_delay=f"{delay:.3f}s"
+                )
+                tasks.add(asyncio.ensure_future(_generate_once(model, contents, config, call, estimated_tokens)))
+
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is not primary:
+                        metrics.increment('gemini_hedges_total', call=call, result='won')
+                    return task.result()
+        # 全部失败时以原始请求的错误为准
+        return primary.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def generate_content_async(model, contents, config, call='single', estimated_tokens=None, request_id='unknown'):
+    """调用Gemini异步接口: 429、5xx、超时和连接错误按指数退避加抖动重试，其他错误直接抛出
+
+    estimated_tokens为本次调用的预计token数(用于密钥池额度和本地限流)，默认只计系统提示词和输出
+    """
+    if estimated_tokens is None:
+        estimated_tokens = estimate_call_tokens([])
+    attempt = 0
+    while True:
+        try:
+            return await _generate_hedged(model, contents, config, call, estimated_tokens, request_id)
+        except Exception as e:
+            reason = retry_reason(e)
+            if reason is None or attempt >= settings.GEMINI_MAX_RETRIES:
+                if reason is not None:
+                    metrics.increment('gemini_retries_exhausted_total', call=call)
+                raise
+            delay = backoff_delay(attempt)
+            attempt += 1
+            metrics.increment('gemini_retries_total', call=call, reason=reason)
+            logger.warning(
+                f"Retrying Gemini request",
+                request_id=request_id,
+                call=call,
+                attempt=attempt,
+                reason=reason,
+                delay=f"{delay:.3f}s",
+                error_message=str(e)
+            )
+            await asyncio.sleep(delay)
+
+
+@monitor_performance("Gemini Image Analysis")
+def analyze_image_with_gemini(image_data, mime_type, include_description=True, url=None, request_id='unknown'):
+    """使用Gemini AI分析图片(同步版本，供脚本等非异步环境使用)"""
+    try:
+        _log_analysis_start(image_data, mime_type, include_description, url, request_id)
+        start_time = time.time()
+        model, content, generate_content_config = _prepare_request(
+            image_data, mime_type, include_description, url, request_id
         )
         
         logger.info(
@@ -85,7 +285,7 @@ def analyze_image_with_gemini(image_data, mime_type, include_description=True, u
         )
         
         api_start_time = time.time()
-        response = client.models.generate_content(
+        response = gemini_client_manager.get_client().models.generate_content(
             model=model,
             contents=content,
             config=generate_content_config,
@@ -98,146 +298,48 @@ def analyze_image_with_gemini(image_data, mime_type, include_description=True, u
             api_duration=f"{api_duration:.3f}s"
         )
         
-        result_text = response.text.strip() if response.text else ""
+        return parse_gemini_response(response, include_description, request_id, start_time)
+    except Exception as e:
+        _log_analysis_failure(e, request_id)
+        raise Exception(f"图片分析失败: {str(e)}")
+
+
+@monitor_async_performance("Gemini Image Analysis")
+async def analyze_image_with_gemini_async(image_data, mime_type, include_description=True, url=None, request_id='unknown'):
+    """使用Gemini AI分析图片(原生异步版本，不占用线程池)"""
+    try:
+        _log_analysis_start(image_data, mime_type, include_description, url, request_id)
+        start_time = time.time()
+        model, content, generate_content_config = _prepare_request(
+            image_data, mime_type, include_description, url, request_id
+        )
         
-        logger.debug(
-            f"Raw Gemini response",
+        logger.info(
+            f"Sending async request to Gemini API",
             request_id=request_id,
-            response_length=len(result_text),
-            response_preview=result_text[:200] + "..." if len(result_text) > 200 else result_text
+            model=model
         )
         
-        # 优化解析逻辑: 首先检查是否包含JSON代码块
-        result_json = None
-        parsing_method = "unknown"
+        api_start_time = time.time()
+        response = await generate_content_async(
+            model, content, generate_content_config,
+            estimated_tokens=estimate_call_tokens([image_data]),
+            request_id=request_id
+        )
+        api_duration = time.time() - api_start_time
+        input_tokens, output_tokens = usage_ledger.record(
+            response.usage_metadata, request_usage=current_usage()
+        )
         
-        try:
-            # 方法1: 检查是否包含JSON代码块，优先处理这种常见格式
-            if '```json' in result_text:
-                logger.debug(
-                    f"Detected JSON code block, extracting directly",
-                    request_id=request_id
-                )
-                json_start = result_text.find('```json') + 7
-                json_end = result_text.find('```', json_start)
-                if json_end != -1:
-                    json_content = result_text[json_start:json_end].strip()
-                    result_json = json.loads(json_content)
-                    parsing_method = "code_block"
-                else:
-                    raise ValueError("JSON代码块格式不完整")
-            else:
-                # 方法2: 尝试直接解析整个响应为JSON
-                logger.debug(
-                    f"No code block detected, attempting direct JSON parsing",
-                    request_id=request_id
-                )
-                result_json = json.loads(result_text)
-                parsing_method = "direct"
-            
-            # 验证JSON格式完整性
-            if 'is_room' not in result_json:
-                raise ValueError("JSON格式不完整: 缺少is_room字段")
-                
-            is_room = result_json['is_room']
-            if include_description:
-                room_type = result_json.get('room_type', '其他')
-                basic_info = result_json.get('basic_info', '')
-                features = result_json.get('features', '')
-                description = {
-                    'room_type': room_type,
-                    'basic_info': basic_info,
-                    'features': features
-                }
-            else:
-                description = {}
-            analysis_time = time.time() - start_time
-            
-            logger.info(
-                f"Successfully parsed Gemini response",
-                request_id=request_id,
-                is_room=is_room,
-                room_type=room_type if include_description else None,
-                analysis_duration=f"{analysis_time:.3f}s",
-                parsing_method=parsing_method
-            )
-            
-            return is_room, description
-            
-        except (json.JSONDecodeError, ValueError) as e:
-            # 只有在两种标准方法都失败时才记录警告并使用回退解析
-            logger.warning(
-                f"Standard JSON parsing methods failed, using fallback parsing",
-                request_id=request_id,
-                error_type=type(e).__name__,
-                attempted_method=parsing_method,
-                raw_response=result_text[:300] + "..." if len(result_text) > 300 else result_text
-            )
-            
-            # 回退解析逻辑
-            result_text_lower = result_text.lower()
-            is_room = False
-            if 'true' in result_text_lower or '是房间' in result_text or '房间' in result_text:
-                is_room = True
-                
-            # 尝试其他可能的JSON提取方法
-            description = {}
-            try:
-                # 尝试寻找其他格式的JSON
-                import re
-                json_pattern = r'\{[^{}]*"is_room"[^{}]*\}'
-                matches = re.findall(json_pattern, result_text, re.DOTALL)
-                if matches:
-                    for match in matches:
-                        try:
-                            result_json = json.loads(match)
-                            if 'is_room' in result_json:
-                                is_room = result_json['is_room']
-                                if include_description:
-                                    room_type = result_json.get('room_type', '其他')
-                                    basic_info = result_json.get('basic_info', '')
-                                    features = result_json.get('features', '')
-                                    description = {
-                                        'room_type': room_type,
-                                        'basic_info': basic_info,
-                                        'features': features
-                                    }
-                                break
-                        except:
-                            continue
-            except Exception as parse_error:
-                logger.debug(
-                    f"Regex-based JSON extraction also failed",
-                    request_id=request_id,
-                    error_type=type(parse_error).__name__
-                )
-                
-            if include_description and not description:
-                description = {
-                    'room_type': '其他' if is_room else '',
-                    'basic_info': result_text[:100] + "..." if len(result_text) > 100 else result_text,
-                    'features': '图片分析成功，但无法提取详细特点'
-                }
-            elif not description:
-                description = {}
-                
-            analysis_time = time.time() - start_time
-            
-            logger.info(
-                f"Completed analysis with fallback parsing",
-                request_id=request_id,
-                is_room=is_room,
-                analysis_duration=f"{analysis_time:.3f}s",
-                parsing_method="fallback"
-            )
-            
-            return is_room, description
-    except Exception as e:
-        logger.error(
-            f"Gemini analysis failed with exception",
+        logger.info(
+            f"Received response from Gemini API",
             request_id=request_id,
-            error_type=type(e).__name__,
-            error_message=str(e),
-            stack_trace=traceback.format_exc()
+            api_duration=f"{api_duration:.3f}s",
+            input_tokens=input_tokens,
+            output_tokens=output_tokens
         )
-        raise Exception(f"图片分析失败: {str(e)}") 
\ No newline at end of file
+        
+        return parse_gemini_response(response, include_description, request_id, start_time)
+    except Exception as e:
+        _log_analysis_failure(e, request_id)
+        raise Exception(f"图片分析失败: {str(e)}")
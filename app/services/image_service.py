@@ -1,23 +1,153 @@
 import asyncio
-import functools
+import hashlib
 import uuid
 import time
 from ..core.logging import logger
 from ..core.config import settings
+from ..core.metrics import metrics
 from ..utils.image_utils import download_image
-from ..utils.url_utils import extract_image_url_from_google_search
+from ..utils.url_utils import extract_image_url_from_google_search, normalize_url
 from ..utils.decorators import monitor_async_performance
-from .gemini_service import analyze_image_with_gemini
+from ..utils.deadline import DeadlineExceeded, deadline_stage
+from .gemini_service import analyze_image_with_gemini_async
+from .gemini_batch import gemini_batcher
+from .result_cache import result_cache
+from .url_cache import url_cache
+from .preprocess_service import image_preprocessor
+from .phash_index import near_duplicate_detector
+from .single_flight import SingleFlight
+from .memory_budget import memory_budget
+from .scheduler import FairScheduler, LANE_WEIGHTS
+from .adaptive_limit import gemini_limiter
 
 
-# 创建下载信号量和分析信号量，用于控制并发
-download_semaphore = asyncio.Semaphore(settings.MAX_CONCURRENT_DOWNLOADS)
-analysis_semaphore = asyncio.Semaphore(settings.MAX_CONCURRENT_ANALYSIS)
+# 下载和分析槽位调度器，用于控制并发(按客户端和通道公平分配)
+download_scheduler = FairScheduler('download', settings.MAX_CONCURRENT_DOWNLOADS, LANE_WEIGHTS)
+# 批量模式下每个分析槽位可容纳一个批次；槽位数跟随Gemini自适应并发上限调整
+ANALYSIS_SLOTS_PER_CALL = settings.GEMINI_BATCH_SIZE if settings.GEMINI_BATCH_ENABLED else 1
+analysis_scheduler = FairScheduler(
+    'analysis',
+    gemini_limiter.limit * ANALYSIS_SLOTS_PER_CALL,
+    LANE_WEIGHTS
+)
+gemini_limiter.add_listener(lambda limit: analysis_scheduler.set_capacity(limit * ANALYSIS_SLOTS_PER_CALL))
+
+# 批次整体超时前留给各图片自行超时返回的时间(秒)，以便结果中带有具体的超时阶段
+DEADLINE_GRACE = 0.05
+
+# 合并相同URL的并发处理(同一批次内或多个并发请求之间)
+image_flights = SingleFlight('process_image')
+
+
+async def _analyze_image(image_data, mime_type, include_description, url, request_id):
+    """分析已下载的图片，返回(is_room, description)"""
+    async with analysis_scheduler.slot():
+        logger.debug(
+            f"Acquired analysis slot",
+            request_id=request_id,
+            url=url
+        )
+        # 分析阶段耗时(准入控制的服务时间估计)从获得槽位时算起，不含排队时间
+        analysis_start = time.perf_counter()
+        if settings.GEMINI_BATCH_ENABLED:
+            # 批量模式下由打包器把获得槽位的图片打包发送
+            result = await gemini_batcher.analyze(
+                image_data, mime_type, include_description, url, request_id
+            )
+        else:
+            # 使用原生异步调用，等待网络时不占用线程
+            result = await analyze_image_with_gemini_async(
+                image_data, mime_type, include_description, url, request_id
+            )
+        metrics.observe('stage_seconds', time.perf_counter() - analysis_start, stage='analysis')
+        return result
+
+
+async def _analyze_with_cache(image, include_description, url, request_id):
+    """分析已获取的图片数据: 依次查询内容缓存、近似重复索引，未命中时预处理并调用Gemini
+
+    返回((is_room, description), 缓存键, 缓存命中信息)
+    """
+    cache_key = None
+    cached = None
+    if settings.RESULT_CACHE_ENABLED:
+        cache_key = result_cache.make_key(image.data, include_description)
+        cached = await result_cache.aget(cache_key)
+    cache_info = {'cache_hit': cached is not None}
+
+    # 按感知哈希查找近似重复图片(缩放、重新压缩、水印后的同一张图)
+    dhash = None
+    if cached is None and settings.PHASH_ENABLED:
+        dhash = await image_preprocessor.compute_dhash(image, url, request_id)
+        if dhash is not None:
+            near_match = near_duplicate_detector.find(dhash, include_description)
+            if near_match is not None:
+                cached, distance = near_match
+                cache_info['near_duplicate'] = True
+                cache_info['duplicate_distance'] = distance
+
+    if cached is not None:
+        logger.info(
+            f"Cache hit, skipping Gemini analysis",
+            request_id=request_id,
+            url=url,
+            near_duplicate=cache_info.get('near_duplicate', False),
+            distance=cache_info.get('duplicate_distance')
+        )
+        return cached, cache_key, cache_info
+
+    # 缩放和重新编码(在进程池中执行)，缓存键仍基于原始内容
+    payload = image
+    if settings.PREPROCESS_ENABLED:
+        payload = await image_preprocessor.preprocess(image, url, request_id)
+    result = await _analyze_image(
+        payload.data,
+        payload.mime_type,
+        include_description,
+        url,
+        request_id
+    )
+    if cache_key is not None:
+        await result_cache.aset(cache_key, result)
+    if dhash is not None:
+        near_duplicate_detector.add(dhash, include_description, result)
+    return result, cache_key, cache_info
+
+
+def _timed_out_result(url, error):
+    """构建超出时间预算的结果"""
+    return {
+        'url': url,
+        'success': False,
+        'timed_out': True,
+        'error': error
+    }
+
+
+def _build_result(url, is_room, description, include_description, cache_info):
+    """构建单张图片的成功结果"""
+    result_item = {
+        'url': url,
+        'success': True,
+        'is_room': is_room,
+        **cache_info
+    }
+    if include_description:
+        result_item['description'] = description
+    return result_item
 
 
 @monitor_async_performance("Process Single Image")
-async def process_image(image_url, include_description, request_id='unknown'):
-    """处理单个图片的异步函数"""
+async def process_image(image_url, include_description, request_id='unknown', deadline=None):
+    """处理单个图片的异步函数
+
+    下载前申请内存预算，图片数据在分析完成(函数返回)时归还预算；
+    传入deadline时排队、下载和分析阶段超出各自的截止点会被取消，返回timed_out结果；
+    阶段截止点从本图片开始处理时按剩余预算划分
+    """
+    if deadline is not None:
+        deadline = deadline.for_item()
+    lease = memory_budget.lease()
     try:
         logger.info(
             f"Starting image processing",
@@ -75,69 +205,110 @@ async def process_image(image_url, include_description, request_id='unknown'):
             final_url=actual_image_url
         )
         
-        # 下载图片(使用信号量控制并发)
-        async with download_semaphore:
-            logger.debug(
-                f"Acquired download semaphore",
+        # 查询URL缓存: 新鲜期内直接复用结果，否则带校验头发送条件请求
+        mode = bool(include_description)
+        cached = None
+        image = None
+        url_entry = url_cache.get(actual_image_url) if settings.URL_CACHE_ENABLED else None
+        if url_entry is not None and mode not in url_entry.results:
+            url_entry = None
+        if url_entry is not None and url_entry.is_fresh():
+            cached = url_entry.results[mode]
+            metrics.increment('url_cache_total', result='fresh')
+            logger.info(
+                f"URL cache fresh, skipping download and analysis",
                 request_id=request_id,
                 url=actual_image_url
             )
-            
+        else:
+            validators = url_entry if url_entry is not None and url_entry.has_validators else None
+
+            # 先申请内存预算和下载槽位: 等待分析的图片过多时暂停新的下载
+            async with deadline_stage(deadline, 'queue'):
+                await lease.reserve(settings.DOWNLOAD_RESERVE_BYTES)
+                await download_scheduler.acquire()
+            lease.activate()
+
+            # 下载图片(使用信号量控制并发)
             try:
-                # 在异步环境中调用同步函数
-                loop = asyncio.get_event_loop()
-                image_data, mime_type = await loop.run_in_executor(
-                    None,
-                    functools.partial(download_image, actual_image_url, request_id)
-                )
-            except Exception as e:
-                logger.error(
-                    f"Image download failed",
+                logger.debug(
+                    f"Acquired download slot",
                     request_id=request_id,
-                    url=actual_image_url,
-                    error_type=type(e).__name__,
-                    error_message=str(e)
+                    url=actual_image_url
                 )
-                return {
-                    'url': image_url,
-                    'success': False,
-                    'error': str(e)
-                }
+                
+                try:
+                    download_start = time.perf_counter()
+                    async with deadline_stage(deadline, 'download'):
+                        image = await download_image(
+                            actual_image_url,
+                            request_id,
+                            validators.etag if validators else None,
+                            validators.last_modified if validators else None,
+                            lease=lease
+                        )
+                except DeadlineExceeded:
+                    raise
+                except Exception as e:
+                    logger.error(
+                        f"Image download failed",
+                        request_id=request_id,
+                        url=actual_image_url,
+                        error_type=type(e).__name__,
+                        error_message=str(e)
+                    )
+                    return {
+                        'url': image_url,
+                        'success': False,
+                        'error': str(e)
+                    }
+            finally:
+                download_scheduler.release()
 
-        # 分析图片(使用信号量控制并发)
-        async with analysis_semaphore:
-            logger.debug(
-                f"Acquired analysis semaphore",
+            metrics.observe('stage_seconds', time.perf_counter() - download_start, stage='download')
+            lease.trim_to(image.size)
+            if image.not_modified:
+                # 304 Not Modified: 复用缓存结果并延长新鲜期
+                cached = url_entry.results[mode]
+                url_cache.refresh(actual_image_url, **image.cache_headers)
+                image = None
+                metrics.increment('url_cache_total', result='revalidated')
+            else:
+                metrics.increment('url_cache_total', result='modified' if validators else 'miss')
+
+        # 按内容缓存和感知哈希查询，未命中时调用Gemini分析
+        cache_info = {'cache_hit': True}
+        try:
+            if cached is None:
+                async with deadline_stage(deadline, 'analysis'):
+                    cached, _, cache_info = await _analyze_with_cache(
+                        image, include_description, actual_image_url, request_id
+                    )
+            is_room, description = cached
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.error(
+                f"Image analysis failed",
                 request_id=request_id,
-                url=actual_image_url
+                url=actual_image_url,
+                error_type=type(e).__name__,
+                error_message=str(e)
+            )
+            return {
+                'url': image_url,
+                'success': False,
+                'error': str(e)
+            }
+
+        if settings.URL_CACHE_ENABLED and image is not None:
+            url_cache.store(
+                actual_image_url,
+                include_description,
+                (is_room, description),
+                content_hash=hashlib.sha256(image.data).hexdigest(),
+                **image.cache_headers
             )
-            
-            try:
-                # 在异步环境中调用同步函数
-                is_room, description = await loop.run_in_executor(
-                    None,
-                    functools.partial(
-                        analyze_image_with_gemini,
-                        image_data,
-                        mime_type,
-                        include_description,
-                        actual_image_url,
-                        request_id
-                    )
-                )
-            except Exception as e:
-                logger.error(
-                    f"Image analysis failed",
-                    request_id=request_id,
-                    url=actual_image_url,
-                    error_type=type(e).__name__,
-                    error_message=str(e)
-                )
-                return {
-                    'url': image_url,
-                    'success': False,
-                    'error': str(e)
-                }
 
         logger.info(
             f"Image processing completed successfully",
@@ -146,18 +317,18 @@ async def process_image(image_url, include_description, request_id='unknown'):
             is_room=is_room,
             room_type=description.get('room_type', None) if include_description else None
         )
-        
-        result_item = {
-            'url': image_url,
-            'actual_url': actual_image_url if actual_image_url != image_url else None,
-            'success': True,
-            'is_room': is_room
-        }
-
-        if include_description:
-            result_item['description'] = description
 
+        result_item = _build_result(image_url, is_room, description, include_description, cache_info)
+        result_item['actual_url'] = actual_image_url if actual_image_url != image_url else None
         return result_item
+    except DeadlineExceeded as e:
+        logger.warning(
+            f"Image processing exceeded request deadline",
+            request_id=request_id,
+            url=image_url,
+            stage=e.stage
+        )
+        return _timed_out_result(image_url, str(e))
     except Exception as e:
         logger.error(
             f"Unexpected error during image processing",
@@ -171,9 +342,161 @@ async def process_image(image_url, include_description, request_id='unknown'):
             'success': False,
             'error': str(e)
         }
+    finally:
+        lease.release()
+
+
+async def process_uploaded_image(image, name, include_description, request_id='unknown'):
+    """处理直接上传的图片(跳过下载阶段)，name为文件名，作为结果中的url字段返回"""
+    try:
+        (is_room, description), _, cache_info = await _analyze_with_cache(
+            image, include_description, name, request_id
+        )
+    except Exception as e:
+        logger.error(
+            f"Uploaded image analysis failed",
+            request_id=request_id,
+            upload_name=name,
+            error_type=type(e).__name__,
+            error_message=str(e)
+        )
+        return {
+            'url': name,
+            'success': False,
+            'error': str(e)
+        }
+
+    logger.info(
+        f"Uploaded image processed successfully",
+        request_id=request_id,
+        upload_name=name,
+        data_size=image.size,
+        is_room=is_room
+    )
+    return _build_result(name, is_room, description, include_description, cache_info)
+
+
+async def process_uploaded_images(uploads, include_description, request_id):
+    """处理上传的多张图片，uploads为按接收顺序产出(序号, 文件名, 图片或错误)的异步迭代器
+
+    每张图片接收完成后立即开始分析；内存预算不足时暂停读取请求体
+    """
+    results = {}
+    tasks = []
+
+    async def run(index, name, image, lease):
+        try:
+            results[index] = await process_uploaded_image(image, name, include_description, request_id)
+        finally:
+            lease.release()
+
+    try:
+        async for index, name, image in uploads:
+            if isinstance(image, Exception):
+                results[index] = {'url': name, 'success': False, 'error': str(image)}
+                continue
+            lease = memory_budget.lease()
+            await lease.acquire(image.size)
+            tasks.append(asyncio.ensure_future(run(index, name, image, lease)))
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    return [results[index] for index in sorted(results)]
+
+
+async def process_image_coalesced(image_url, include_description, request_id='unknown', deadline=None):
+    """处理单个图片，相同URL(规范化后)和模式的并发调用只执行一次
+
+    等待其他调用的处理结果时没有自己下载和分析，结果中标记coalesced
+    """
+    if not image_url:
+        return await process_image(image_url, include_description, request_id, deadline)
+
+    key = (normalize_url(image_url), bool(include_description))
+
+    caller = object()
+
+    async def run():
+        return caller, deadline, await process_image(image_url, include_description, request_id, deadline)
+
+    try:
+        # 合并到其他请求的处理时，仍以本请求的截止时间为准
+        async with deadline_stage(deadline, 'analysis'):
+            owner, owner_deadline, result = await image_flights.do(key, run)
+            coalesced = owner is not caller
+            if result.get('timed_out') and owner_deadline is not deadline:
+                # 超时的是执行处理的请求的预算，本请求的预算未到期时自行处理一次
+                metrics.increment('single_flight_retry_total', flight=image_flights.name)
+                result = await process_image(image_url, include_description, request_id, deadline)
+                coalesced = False
+    except DeadlineExceeded as e:
+        return _timed_out_result(image_url, str(e))
+    # 返回副本，保留调用者自己的原始URL
+    result = {**result, 'url': image_url}
+    if coalesced:
+        result['coalesced'] = True
+        metrics.increment('coalesced_results_total', result='ok' if result.get('success') else 'failed')
+    return result
+
+
+def _pipeline_width():
+    """单个批次同时处理的图片数: 足以占满下载并发和分析并发(批量模式下每个分析槽位可容纳一个批次)"""
+    analysis_slots = settings.MAX_CONCURRENT_ANALYSIS
+    if settings.GEMINI_BATCH_ENABLED:
+        analysis_slots *= settings.GEMINI_BATCH_SIZE
+    return settings.MAX_CONCURRENT_DOWNLOADS + analysis_slots
+
+
+async def iter_batch_images(urls, include_description, request_id, deadline=None, ticket=None):
+    """批处理多个图片，按完成顺序逐个产出(输入序号, 结果)
+
+    超出请求截止时间时停止处理，未完成的图片以timed_out结果产出；
+    传入准入ticket时每完成一张图片归还一个名额
+    """
+    # 固定数量的worker从队列中取URL处理，任务数和内存占用不随批次大小增长
+    width = min(_pipeline_width(), len(urls))
+    completed = asyncio.Queue(maxsize=max(width, 1))
+    pending = iter(enumerate(urls))
+
+    async def worker():
+        for index, url in pending:
+            result = await process_image_coalesced(url, include_description, request_id, deadline)
+            await completed.put((index, result))
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(width)]
+    finished = set()
+    try:
+        while len(finished) < len(urls):
+            # 超时只作用于等待结果，不能跨越yield(否则会取消消费方)
+            try:
+                async with asyncio.timeout_at(deadline.expires_at + DEADLINE_GRACE if deadline else None):
+                    index, result = await completed.get()
+            except TimeoutError:
+                logger.warning(
+                    f"Batch exceeded request deadline, returning partial results",
+                    request_id=request_id,
+                    finished_count=len(finished),
+                    total=len(urls)
+                )
+                break
+            finished.add(index)
+            if ticket is not None:
+                ticket.release()
+            yield index, result
+        for index, url in enumerate(urls):
+            if index not in finished:
+                yield index, _timed_out_result(url, "处理超时: 超出请求时间预算")
+    finally:
+        # 消费方提前退出(如客户端断开)时停止剩余处理
+        for task in workers:
+            task.cancel()
+        if ticket is not None:
+            ticket.close()
 
 
-async def process_batch_images(urls, include_description, request_id):
+async def process_batch_images(urls, include_description, request_id, deadline=None, ticket=None):
     """批处理多个图片"""
     logger.info(
         f"Starting parallel processing of {len(urls)} images",
@@ -182,9 +505,9 @@ async def process_batch_images(urls, include_description, request_id):
         max_concurrent_analysis=settings.MAX_CONCURRENT_ANALYSIS
     )
 
-    # 并行处理所有图片
-    tasks = [process_image(url, include_description, request_id) for url in urls]
-    results = await asyncio.gather(*tasks)
+    results = [None] * len(urls)
+    async for index, result in iter_batch_images(urls, include_description, request_id, deadline, ticket):
+        results[index] = result
 
     # 记录失败的URL
     failed_urls = [result for result in results if not result.get('success', False)]
@@ -196,4 +519,4 @@ async def process_batch_images(urls, include_description, request_id):
             failed_urls=[r.get('url', 'unknown') for r in failed_urls[:5]]  # 只记录前5个
         )
 
-    return results 
\ No newline at end of file
+    return results
@@ -0,0 +1,92 @@
+import asyncio
+import time
+from ..core.logging import logger
+from ..core.config import settings
+from ..core.metrics import metrics
+from .job_store import job_store
+from .image_service import process_image_coalesced
+from .scheduler import set_flow, BULK
+
+
+class JobRunner:
+    """后台worker池: 从持久队列中逐条取出URL，复用process_image处理并写回结果"""
+
+    def __init__(self, store, workers):
+        self.store = store
+        self.workers = workers
+        self._tasks = []
+        self._wakeup = None
+
+    async def start(self):
+        """恢复上次中断的任务并启动worker(在事件循环中调用)"""
+        if self._tasks:
+            return
+        await asyncio.to_thread(self.store.recover)
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        logger.info(f"Job workers started", workers=self.workers)
+
+    async def close(self):
+        """停止worker，处理中的记录在下次启动时重新执行"""
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.store.close()
+        if tasks:
+            logger.info(f"Job workers stopped")
+
+    async def submit(self, urls, include_description):
+        """创建任务并唤醒worker，返回任务ID"""
+        job_id = await asyncio.to_thread(self.store.create_job, urls, include_description)
+        metrics.increment('jobs_created_total')
+        metrics.increment('job_items_created_total', len(urls))
+        if self._wakeup is not None:
+            self._wakeup.set()
+        logger.info(
+            f"Job created",
+            job_id=job_id,
+            total=len(urls),
+            include_description=include_description
+        )
+        return job_id
+
+    async def _worker(self):
+        while True:
+            try:
+                item = await asyncio.to_thread(self.store.claim_next)
+                if item is None:
+                    await self._wait_for_work()
+                    continue
+                await self._process_item(*item)
+            except Exception as e:
+                # 数据库异常等: 记录后继续，未完成的记录在重启时重新执行
+                logger.error(
+                    f"Job worker error",
+                    error_type=type(e).__name__,
+                    error_message=str(e)
+                )
+                await asyncio.sleep(1)
+
+    async def _process_item(self, job_id, index, url, include_description):
+        # 异步任务走bulk通道，不同任务之间轮流获得槽位
+        set_flow(f"job:{job_id}", BULK)
+        start_time = time.perf_counter()
+        result = await process_image_coalesced(url, include_description, job_id)
+        await asyncio.to_thread(self.store.complete_item, job_id, index, result)
+        metrics.increment(
+            'job_items_processed_total',
+            outcome='success' if result.get('success', False) else 'failed'
+        )
+        metrics.observe('job_item_seconds', time.perf_counter() - start_time)
+
+    async def _wait_for_work(self):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=settings.JOB_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+# 创建全局任务执行器
+job_runner = JobRunner(job_store, workers=settings.JOB_WORKERS)
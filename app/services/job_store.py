@@ -0,0 +1,164 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from ..core.logging import logger
+from ..core.config import settings
+
+
+class JobStore:
+    """批量分析任务的持久队列(SQLite)
+
+    每个任务的每个URL是一行job_items记录，完成后立即写入结果。
+    进程重启后只需重新处理未完成的记录，已完成的图片不会重复分析。
+    """
+
+    def __init__(self, db_path, retention):
+        self.db_path = db_path
+        self.retention = retention
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._db is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False)
+            self._db.row_factory = sqlite3.Row
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, include_description INTEGER NOT NULL, "
+                "total INTEGER NOT NULL, succeeded INTEGER NOT NULL DEFAULT 0, "
+                "failed INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL, "
+                "updated_at REAL NOT NULL, finished_at REAL);"
+                "CREATE TABLE IF NOT EXISTS job_items ("
+                "job_id TEXT NOT NULL, idx INTEGER NOT NULL, url TEXT NOT NULL, "
+                "status TEXT NOT NULL, result TEXT, PRIMARY KEY (job_id, idx));"
+                "CREATE INDEX IF NOT EXISTS job_items_status ON job_items (status, job_id, idx);"
+            )
+            self._db.commit()
+        return self._db
+
+    def recover(self):
+        """启动时调用: 把上次中断时正在处理的记录重新放回队列，并清理过期任务，返回恢复的记录数"""
+        with self._lock:
+            db = self._connect()
+            recovered = db.execute(
+                "UPDATE job_items SET status = 'pending' WHERE status = 'running'"
+            ).rowcount
+            expired = [row['id'] for row in db.execute(
+                "SELECT id FROM jobs WHERE finished_at IS NOT NULL AND finished_at <= ?",
+                (time.time() - self.retention,)
+            )]
+            for job_id in expired:
+                db.execute("DELETE FROM job_items WHERE job_id = ?", (job_id,))
+                db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            db.commit()
+        if recovered or expired:
+            logger.info(
+                f"Job queue recovered",
+                requeued_items=recovered,
+                expired_jobs=len(expired)
+            )
+        return recovered
+
+    def create_job(self, urls, include_description):
+        """创建任务并写入全部URL，返回任务ID"""
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.execute(
+                    "INSERT INTO jobs (id, status, include_description, total, created_at, updated_at) "
+                    "VALUES (?, 'queued', ?, ?, ?, ?)",
+                    (job_id, int(bool(include_description)), len(urls), now, now)
+                )
+                db.executemany(
+                    "INSERT INTO job_items (job_id, idx, url, status) VALUES (?, ?, ?, 'pending')",
+                    ((job_id, index, url) for index, url in enumerate(urls))
+                )
+        return job_id
+
+    def claim_next(self):
+        """按任务创建顺序取出下一条待处理记录并标记为处理中，队列为空时返回None"""
+        with self._lock:
+            db = self._connect()
+            with db:
+                row = db.execute(
+                    "SELECT i.job_id, i.idx, i.url, j.include_description FROM job_items i "
+                    "JOIN jobs j ON j.id = i.job_id WHERE i.status = 'pending' "
+                    "ORDER BY j.created_at, i.idx LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    return None
+                db.execute(
+                    "UPDATE job_items SET status = 'running' WHERE job_id = ? AND idx = ?",
+                    (row['job_id'], row['idx'])
+                )
+                db.execute(
+                    "UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ? AND status = 'queued'",
+                    (time.time(), row['job_id'])
+                )
+        return row['job_id'], row['idx'], row['url'], bool(row['include_description'])
+
+    def complete_item(self, job_id, index, result):
+        """保存单条结果并更新任务进度，全部完成时标记任务完成"""
+        now = time.time()
+        column = 'succeeded' if result.get('success', False) else 'failed'
+        with self._lock:
+            db = self._connect()
+            with db:
+                updated = db.execute(
+                    "UPDATE job_items SET status = 'done', result = ? "
+                    "WHERE job_id = ? AND idx = ? AND status != 'done'",
+                    (json.dumps(result, ensure_ascii=False), job_id, index)
+                ).rowcount
+                if not updated:
+                    return
+                db.execute(
+                    f"UPDATE jobs SET {column} = {column} + 1, updated_at = ? WHERE id = ?",
+                    (now, job_id)
+                )
+                db.execute(
+                    "UPDATE jobs SET status = 'completed', finished_at = ? "
+                    "WHERE id = ? AND succeeded + failed >= total",
+                    (now, job_id)
+                )
+
+    def get_job(self, job_id):
+        """查询任务状态，不存在时返回None"""
+        with self._lock:
+            row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def get_results(self, job_id, offset, limit):
+        """返回输入序号在[offset, offset+limit)范围内已完成的结果(按序号排序)
+
+        按输入序号而不是完成顺序分页，后续完成的图片不会改变已有分页的位置
+        """
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT idx, result FROM job_items WHERE job_id = ? AND status = 'done' "
+                "AND idx >= ? AND idx < ? ORDER BY idx",
+                (job_id, offset, offset + limit)
+            ).fetchall()
+        return [{**json.loads(row['result']), 'index': row['idx']} for row in rows]
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+# 创建全局任务存储
+job_store = JobStore(
+    db_path=settings.JOB_DB_PATH,
+    retention=settings.JOB_RETENTION
+)
@@ -0,0 +1,200 @@
+import asyncio
+import time
+from ..core.logging import logger
+from ..core.config import settings
+from ..core.metrics import metrics
+
+
+# 密钥首次返回配额错误时的冷却秒数，连续出错时加倍，最长为cooldown_seconds
+COOLDOWN_BASE_SECONDS = 2.0
+
+
+class TokenBucket:
+    """每分钟补充per_minute个令牌的令牌桶，最多积累一分钟的额度
+
+    per_minute为0表示不限制。消耗可以超过当前余额(记为欠额)，之后按补充速度偿还。
+    """
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self._tokens = float(per_minute)
+        self._updated_at = time.monotonic()
+
+    @property
+    def unlimited(self):
+        return self.per_minute <= 0
+
+    def available(self):
+        if self.unlimited:
+            return float('inf')
+        now = time.monotonic()
+        self._tokens = min(self.per_minute, self._tokens + (now - self._updated_at) * self.per_minute / 60)
+        self._updated_at = now
+        return self._tokens
+
+    def headroom(self, amount=0):
+        """扣除amount后剩余额度占每分钟额度的比例(不限制时为1)"""
+        if self.unlimited:
+            return 1.0
+        return (self.available() - amount) / self.per_minute
+
+    def consume(self, amount):
+        """扣除额度，amount为负数时退还"""
+        if not self.unlimited:
+            self._tokens = min(self.per_minute, self.available() - amount)
+
+    def seconds_until(self, amount):
+        """额度补充到amount(不超过每分钟额度)还需等待的秒数"""
+        if self.unlimited:
+            return 0.0
+        missing = min(amount, self.per_minute) - self.available()
+        return max(0.0, missing * 60 / self.per_minute)
+
+
+class ApiKey:
+    """一个Gemini API密钥及其请求数和token额度"""
+
+    def __init__(self, index, api_key, rpm, tpm):
+        self.api_key = api_key
+        # 指标和日志中只使用序号和密钥末4位
+        self.key_id = f"key{index}"
+        self.suffix = api_key[-4:]
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.cooldown_until = 0.0
+        self.throttle_streak = 0
+        self.in_flight = 0
+
+    def headroom(self, estimated_tokens):
+        """调用后剩余额度的比例，取请求数和token中较紧张的一项"""
+        return min(self.requests.headroom(1), self.tokens.headroom(estimated_tokens))
+
+    def seconds_until_ready(self, estimated_tokens):
+        """冷却结束且请求数和token额度足够本次调用还需等待的秒数"""
+        return max(
+            self.cooldown_until - time.monotonic(),
+            self.requests.seconds_until(1),
+            self.tokens.seconds_until(estimated_tokens)
+        )
+
+    def snapshot(self):
+        return {
+            'key_id': self.key_id,
+            'suffix': self.suffix,
+            'rpm_available': _round_available(self.requests),
+            'tpm_available': _round_available(self.tokens),
+            'in_flight': self.in_flight,
+            'cooldown_remaining': round(max(0.0, self.cooldown_until - time.monotonic()), 1)
+        }
+
+
+def _round_available(bucket):
+    return None if bucket.unlimited else round(bucket.available(), 1)
+
+
+class KeyPool:
+    """多个API密钥(可跨项目)之间分配调用，调用前在本地按额度限流
+
+    每次调用选择扣除本次预计用量后剩余额度比例最高的密钥；返回配额错误(429)的密钥冷却一段时间，
+    冷却时间从几秒开始，连续出错时加倍(最长cooldown_seconds)，调用成功后恢复。
+    所有密钥都在冷却或额度不足时，调用按到达顺序排队等待额度补充，而不是发出后被拒绝。
+    调用结束后按响应中的实际token用量修正预计值。
+    """
+
+    def __init__(self, api_keys, rpm, tpm, cooldown_seconds):
+        self.keys = [ApiKey(index, api_key, rpm, tpm) for index, api_key in enumerate(api_keys)]
+        self.cooldown_seconds = cooldown_seconds
+        self.waiting = 0
+        self._queue_lock = None
+
+    async def acquire(self, estimated_tokens):
+        """选择密钥并按预计用量扣除额度，没有可用额度时排队等待"""
+        key = self._ready_key(estimated_tokens) if not self.waiting else None
+        if key is None:
+            key = await self._wait_for_key(estimated_tokens)
+
+        key.requests.consume(1)
+        key.tokens.consume(estimated_tokens)
+        key.in_flight += 1
+        metrics.increment('gemini_key_requests_total', key=key.key_id)
+        metrics.increment('gemini_key_estimated_tokens_total', estimated_tokens, key=key.key_id)
+        self._update_gauges(key)
+        return key
+
+    def _ready_key(self, estimated_tokens):
+        """额度足够本次调用的密钥中剩余比例最高的一个，没有时返回None"""
+        ready = [key for key in self.keys if key.seconds_until_ready(estimated_tokens) <= 0]
+        if not ready:
+            return None
+        return max(ready, key=lambda key: key.headroom(estimated_tokens))
+
+    async def _wait_for_key(self, estimated_tokens):
+        # asyncio.Lock按到达顺序唤醒等待者，队首等到额度后才轮到下一个
+        if self._queue_lock is None:
+            self._queue_lock = asyncio.Lock()
+        start_time = time.perf_counter()
+        self.waiting += 1
+        metrics.set_gauge('gemini_rate_limit_waiting', self.waiting)
+        try:
+            async with self._queue_lock:
+                while True:
+                    key = self._ready_key(estimated_tokens)
+                    if key is not None:
+                        break
+                    await asyncio.sleep(min(key.seconds_until_ready(estimated_tokens) for key in self.keys))
+        finally:
+            self.waiting -= 1
+            metrics.set_gauge('gemini_rate_limit_waiting', self.waiting)
+        wait_time = time.perf_counter() - start_time
+        metrics.observe('gemini_rate_limit_wait_seconds', wait_time)
+        if wait_time > 0.001:
+            metrics.increment('gemini_key_delayed_total', key=key.key_id)
+        return key
+
+    def release(self, key, quota_exceeded=False, estimated_tokens=0, actual_tokens=None, sent=True):
+        """调用结束: 按实际用量修正token额度，未发出的调用退还额度；返回配额错误时该密钥进入冷却"""
+        key.in_flight -= 1
+        if not sent:
+            key.requests.consume(-1)
+            key.tokens.consume(-estimated_tokens)
+        elif actual_tokens is not None:
+            key.tokens.consume(actual_tokens - estimated_tokens)
+            metrics.increment('gemini_key_tokens_total', actual_tokens, key=key.key_id)
+        if quota_exceeded:
+            metrics.increment('gemini_key_throttled_total', key=key.key_id)
+            now = time.monotonic()
+            # 单次限流多为瞬时的，只有冷却结束后仍然出错才加倍(只有一个密钥时冷却会暂停所有调用)；
+            # 冷却开始前已发出的调用返回的配额错误不再延长冷却
+            if now >= key.cooldown_until:
+                cooldown = min(self.cooldown_seconds, COOLDOWN_BASE_SECONDS * 2 ** key.throttle_streak)
+                key.throttle_streak += 1
+                key.cooldown_until = now + cooldown
+                logger.warning(
+                    f"Gemini API key quota exceeded, cooling down",
+                    key_id=key.key_id,
+                    key_suffix=key.suffix,
+                    cooldown=f"{cooldown}s"
+                )
+        elif sent:
+            key.throttle_streak = 0
+        self._update_gauges(key)
+
+    @staticmethod
+    def _update_gauges(key):
+        if not key.requests.unlimited:
+            metrics.set_gauge('gemini_key_rpm_available', round(key.requests.available(), 1), key=key.key_id)
+        if not key.tokens.unlimited:
+            metrics.set_gauge('gemini_key_tpm_available', round(key.tokens.available(), 1), key=key.key_id)
+        metrics.set_gauge('gemini_key_in_flight', key.in_flight, key=key.key_id)
+
+    def snapshot(self):
+        return [key.snapshot() for key in self.keys]
+
+
+# 创建全局密钥池
+gemini_key_pool = KeyPool(
+    settings.GEMINI_API_KEYS,
+    rpm=settings.GEMINI_KEY_RPM,
+    tpm=settings.GEMINI_KEY_TPM,
+    cooldown_seconds=settings.GEMINI_KEY_COOLDOWN
+)
@@ -0,0 +1,173 @@
+import asyncio
+import time
+from collections import deque
+from ..core.config import settings
+from ..core.metrics import metrics
+
+
+class ByteBudget:
+    """进程内图片数据的字节预算
+
+    下载开始前按字节申请预算，分析完成后归还。预算不足时新的下载按先来先服务排队等待，
+    使进程内同时驻留的图片数据总量保持在上限附近，而与批次大小无关。
+
+    排队等待下载槽位的图片持有的预留(idle)还不是实际数据。已占用下载槽位的图片按Content-Length
+    补足预算时排在普通申请之前，且不计入这些预留，否则预留占满预算后，持有槽位的下载等待补足、
+    排队的图片等待槽位，双方互相等待。补足因此最多使预算超出 下载槽位数 × 预留字节数。
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.in_use = 0
+        self.idle = 0
+        self._waiters = deque()
+        self._top_ups = deque()
+
+    @property
+    def waiting(self):
+        return len(self._waiters) + len(self._top_ups)
+
+    async def acquire(self, nbytes, idle=False):
+        """申请nbytes字节(超过总预算时按总预算计算)，返回实际占用的字节数
+
+        idle为True表示为尚未开始下载的图片预留，开始下载后由activate转为实际占用
+        """
+        nbytes = min(nbytes, self.capacity)
+        if not self._top_ups and not self._waiters and self.in_use + nbytes <= self.capacity:
+            self._take(nbytes, idle)
+            return nbytes
+        return await self._wait(self._waiters, nbytes, idle)
+
+    async def top_up(self, nbytes):
+        """已开始下载的图片补足预算，优先于普通申请，不计入其他图片尚未使用的预留"""
+        nbytes = min(nbytes, self.capacity)
+        if not self._top_ups and self._fits_top_up(nbytes):
+            self._take(nbytes)
+            return nbytes
+        return await self._wait(self._top_ups, nbytes, False)
+
+    async def _wait(self, queue, nbytes, idle):
+        waiter = (nbytes, idle, asyncio.get_running_loop().create_future())
+        queue.append(waiter)
+        self._update_gauges()
+        start_time = time.perf_counter()
+        try:
+            await waiter[2]
+        except asyncio.CancelledError:
+            if waiter[2].done() and not waiter[2].cancelled():
+                # 预算已分配但调用者被取消，归还
+                self.release(nbytes, nbytes if idle else 0)
+            else:
+                # 同一轮事件循环中归还预算时，_wake可能已经弹出了这个已取消的等待者
+                if waiter in queue:
+                    queue.remove(waiter)
+                self._wake()
+            raise
+        finally:
+            metrics.observe('memory_budget_wait_seconds', time.perf_counter() - start_time)
+        return nbytes
+
+    def reserve_nowait(self, nbytes):
+        """不等待直接占用预算(允许暂时超出上限)，用于已在传输中的数据"""
+        self._take(nbytes)
+
+    def activate(self, nbytes):
+        """nbytes字节的预留开始用于下载的数据"""
+        self.idle -= nbytes
+        self._update_gauges()
+
+    def release(self, nbytes, idle_bytes=0):
+        """归还nbytes字节，其中idle_bytes字节是尚未使用的预留"""
+        self.in_use -= nbytes
+        self.idle -= idle_bytes
+        self._wake()
+
+    def _fits_top_up(self, nbytes):
+        return self.in_use - self.idle + nbytes <= self.capacity
+
+    def _take(self, nbytes, idle=False):
+        self.in_use += nbytes
+        if idle:
+            self.idle += nbytes
+        self._update_gauges()
+
+    def _wake(self):
+        while self._top_ups and self._fits_top_up(self._top_ups[0][0]):
+            self._grant(self._top_ups.popleft())
+        # 补足请求未满足前不分配新的预留
+        while not self._top_ups and self._waiters and self.in_use + self._waiters[0][0] <= self.capacity:
+            self._grant(self._waiters.popleft())
+        self._update_gauges()
+
+    def _grant(self, waiter):
+        nbytes, idle, future = waiter
+        if not future.done():
+            self.in_use += nbytes
+            if idle:
+                self.idle += nbytes
+            future.set_result(None)
+
+    def _update_gauges(self):
+        metrics.set_gauge('memory_budget_bytes_in_use', self.in_use)
+        metrics.set_gauge('memory_budget_bytes_reserved_idle', self.idle)
+        metrics.set_gauge('memory_budget_waiters', self.waiting)
+
+    def lease(self):
+        return BudgetLease(self)
+
+
+class BudgetLease:
+    """单张图片占用的预算，随下载数据增长，处理结束时一次性归还"""
+
+    def __init__(self, budget):
+        self._budget = budget
+        self.nbytes = 0
+        self.idle = 0
+
+    async def acquire(self, nbytes):
+        self.nbytes += await self._budget.acquire(nbytes)
+
+    async def reserve(self, nbytes):
+        """排队等待下载槽位前预留预算，获得槽位后调用activate"""
+        granted = await self._budget.acquire(nbytes, idle=True)
+        self.nbytes += granted
+        self.idle += granted
+
+    def activate(self):
+        """已获得下载槽位，预留转为实际占用"""
+        if self.idle:
+            self._budget.activate(self.idle)
+            self.idle = 0
+
+    async def top_up_to(self, nbytes):
+        """下载中按Content-Length补足占用，预算不足时等待(优先于新的预留)"""
+        if nbytes > self.nbytes:
+            self.nbytes += await self._budget.top_up(nbytes - self.nbytes)
+
+    def grow_to(self, nbytes):
+        """按已接收的数据量补足占用(不等待)，用于没有Content-Length的响应体"""
+        if nbytes is not None and nbytes > self.nbytes:
+            self._budget.reserve_nowait(nbytes - self.nbytes)
+            self.nbytes = nbytes
+
+    def trim_to(self, nbytes):
+        """下载完成后按实际数据量归还多余的预留"""
+        if nbytes < self.nbytes:
+            self._budget.release(self.nbytes - nbytes)
+            self.nbytes = nbytes
+
+    def release(self):
+        if self.nbytes:
+            self._budget.release(self.nbytes, self.idle)
+            self.nbytes = 0
+            self.idle = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+
+# 创建全局字节预算
+memory_budget = ByteBudget(settings.MEMORY_BUDGET_BYTES)
@@ -0,0 +1,124 @@
+import threading
+from collections import OrderedDict
+from ..core.config import settings
+from ..core.metrics import metrics
+
+
+HASH_BITS = 64
+
+# 细节过少的图片(如纯色图)哈希几乎全0或全1，相互之间都会"相似"，不参与匹配
+MIN_HASH_BITS_SET = 3
+
+
+def hamming_distance(a, b):
+    return (a ^ b).bit_count()
+
+
+def is_informative_hash(value):
+    """哈希是否包含足够的细节用于近似匹配"""
+    bits_set = value.bit_count()
+    return MIN_HASH_BITS_SET <= bits_set <= HASH_BITS - MIN_HASH_BITS_SET
+
+
+class PerceptualHashIndex:
+    """感知哈希多索引(multi-index hashing)
+
+    把64位哈希切分为threshold+1段，每段建立精确匹配的倒排表。
+    由鸽巢原理，汉明距离不超过threshold的两个哈希至少有一段完全相同，
+    因此只需检查各段命中的候选项，而不必遍历全部条目。
+    """
+
+    def __init__(self, threshold, max_entries):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        segment_count = threshold + 1
+        base, extra = divmod(HASH_BITS, segment_count)
+        self._segments = []
+        shift = 0
+        for i in range(segment_count):
+            width = base + (1 if i < extra else 0)
+            self._segments.append((shift, (1 << width) - 1))
+            shift += width
+        self._tables = [{} for _ in self._segments]
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _segment_values(self, value):
+        return [(value >> shift) & mask for shift, mask in self._segments]
+
+    def add(self, value, result):
+        """添加或更新一个哈希对应的结果"""
+        with self._lock:
+            if value in self._entries:
+                self._entries[value] = result
+                self._entries.move_to_end(value)
+                return
+            self._entries[value] = result
+            for table, segment in zip(self._tables, self._segment_values(value)):
+                table.setdefault(segment, set()).add(value)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._remove_from_tables(evicted)
+
+    def _remove_from_tables(self, value):
+        for table, segment in zip(self._tables, self._segment_values(value)):
+            bucket = table.get(segment)
+            if bucket is not None:
+                bucket.discard(value)
+                if not bucket:
+                    del table[segment]
+
+    def find(self, value):
+        """查找汉明距离最近且不超过阈值的条目，返回(结果, 距离)或None"""
+        with self._lock:
+            best = None
+            checked = set()
+            for table, segment in zip(self._tables, self._segment_values(value)):
+                for candidate in table.get(segment, ()):
+                    if candidate in checked:
+                        continue
+                    checked.add(candidate)
+                    distance = hamming_distance(value, candidate)
+                    if distance <= self.threshold and (best is None or distance < best[1]):
+                        best = (candidate, distance)
+                        if distance == 0:
+                            break
+            if best is None:
+                return None
+            self._entries.move_to_end(best[0])
+            return self._entries[best[0]], best[1]
+
+
+class NearDuplicateDetector:
+    """按分析模式维护感知哈希索引，复用相似图片的分析结果"""
+
+    def __init__(self, threshold, max_entries):
+        self._indexes = {
+            mode: PerceptualHashIndex(threshold, max_entries) for mode in (True, False)
+        }
+
+    def find(self, value, include_description):
+        """查找近似重复图片的结果，返回(结果, 距离)或None"""
+        if not is_informative_hash(value):
+            metrics.increment('near_duplicate_total', result='skipped')
+            return None
+        match = self._indexes[bool(include_description)].find(value)
+        metrics.increment('near_duplicate_total', result='hit' if match else 'miss')
+        return match
+
+    def add(self, value, include_description, result):
+        if not is_informative_hash(value):
+            return
+        index = self._indexes[bool(include_description)]
+        index.add(value, result)
+        metrics.set_gauge('near_duplicate_index_entries', len(index), mode=bool(include_description))
+
+
+# 创建全局近似重复检测器
+near_duplicate_detector = NearDuplicateDetector(
+    threshold=settings.PHASH_THRESHOLD,
+    max_entries=settings.PHASH_MAX_ENTRIES
+)
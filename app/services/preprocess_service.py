@@ -0,0 +1,112 @@
+import asyncio
+import dataclasses
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from ..core.logging import logger
+from ..core.config import settings
+from ..core.metrics import metrics
+from ..utils.image_processing import preprocess_image_bytes, compute_dhash
+
+
+class ImagePreprocessor:
+    """在进程池中执行图片解码类CPU密集任务(缩放、重新编码、感知哈希)，避免占用事件循环和I/O线程"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def start(self):
+        """创建进程池(每个worker进程启动时调用一次)"""
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=settings.PREPROCESS_WORKERS)
+                logger.info(
+                    f"Image preprocess pool initialized",
+                    workers=settings.PREPROCESS_WORKERS,
+                    max_edge=settings.PREPROCESS_MAX_EDGE,
+                    output_format=settings.PREPROCESS_FORMAT
+                )
+
+    def close(self):
+        """关闭进程池"""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+            logger.info(f"Image preprocess pool closed")
+
+    async def preprocess(self, image, url=None, request_id='unknown'):
+        """预处理DownloadedImage，返回替换了数据和MIME类型的新记录；失败时返回原图"""
+        if self._pool is None:
+            self.start()
+
+        start_time = time.perf_counter()
+        bytes_before = image.size
+        try:
+            loop = asyncio.get_running_loop()
+            data, mime_type, info = await loop.run_in_executor(
+                self._pool,
+                preprocess_image_bytes,
+                image.data,
+                settings.PREPROCESS_MAX_EDGE,
+                settings.PREPROCESS_FORMAT,
+                settings.PREPROCESS_QUALITY
+            )
+        except Exception as e:
+            # 例如Pillow无法解码的HEIC，直接发送原图
+            metrics.increment('preprocess_total', action='failed')
+            logger.warning(
+                f"Image preprocessing failed, sending original image",
+                request_id=request_id,
+                url=url,
+                error_type=type(e).__name__,
+                error_message=str(e)
+            )
+            return image
+
+        duration = time.perf_counter() - start_time
+        bytes_after = len(data)
+        metrics.increment('preprocess_total', action=info['action'])
+        metrics.observe('preprocess_bytes_before', bytes_before)
+        metrics.observe('preprocess_bytes_after', bytes_after)
+        metrics.observe('preprocess_seconds', duration)
+
+        logger.info(
+            f"Image preprocessed",
+            request_id=request_id,
+            url=url,
+            action=info['action'],
+            source_format=info['source_format'],
+            original_size=info['original_size'],
+            output_size=info['output_size'],
+            bytes_before=bytes_before,
+            bytes_after=bytes_after,
+            duration=f"{duration:.3f}s",
+            cpu_duration=f"{info['duration']:.3f}s"
+        )
+
+        if mime_type is None:
+            return image
+        return dataclasses.replace(image, data=data, mime_type=mime_type)
+
+    async def compute_dhash(self, image, url=None, request_id='unknown'):
+        """在进程池中计算图片的感知哈希，失败时返回None"""
+        if self._pool is None:
+            self.start()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._pool, compute_dhash, image.data)
+        except Exception as e:
+            logger.warning(
+                f"Perceptual hash computation failed",
+                request_id=request_id,
+                url=url,
+                error_type=type(e).__name__,
+                error_message=str(e)
+            )
+            return None
+
+
+# 创建全局预处理器
+image_preprocessor = ImagePreprocessor()
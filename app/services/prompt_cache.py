@@ -0,0 +1,166 @@
+import asyncio
+import time
+from google.genai import types
+from ..core.logging import logger
+from ..core.config import settings
+from ..core.metrics import metrics
+from .gemini_client import gemini_client_manager
+
+
+def is_cache_rejection(error):
+    """Gemini拒绝了请求引用的缓存(缓存已过期删除或不属于该密钥的项目)，而不是请求本身有问题"""
+    if getattr(error, 'code', None) not in (403, 404):
+        return False
+    return 'cache' in str(error).lower()
+
+
+class _CacheEntry:
+    """一个密钥下一种请求配置的系统提示词缓存"""
+
+    def __init__(self, config):
+        self.config = config
+        self.name = None
+        self.cached_config = None
+        self.expires_at = 0.0
+        self.retry_at = 0.0
+        self.task = None
+
+
+class PromptCache:
+    """把系统提示词放入Gemini上下文缓存，请求通过cached_content引用而不是每次内联发送
+
+    缓存按(密钥, 请求配置)分别创建(缓存属于密钥所在的项目)，首次使用时在后台创建，剩余有效期
+    不足refresh_margin时在后台续期。缓存尚未就绪、创建失败(如提示词不足最小token数、模型不支持)
+    或已失效时使用内联提示词，不影响请求。get_client和clock可替换为测试用的本地假客户端和时钟。
+    """
+
+    def __init__(self, model, ttl, refresh_margin, retry_seconds, get_client=None, clock=time.monotonic):
+        self.model = model
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.retry_seconds = retry_seconds
+        self._get_client = get_client or gemini_client_manager.get_client
+        self._clock = clock
+        self._entries = {}
+
+    def resolve(self, api_key, config):
+        """返回本次请求使用的配置: 缓存可用时为引用缓存的配置，否则为原配置"""
+        key = (api_key, id(config))
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = _CacheEntry(config)
+
+        now = self._clock()
+        if entry.task is None:
+            if entry.name is None or now >= entry.expires_at:
+                if now >= entry.retry_at:
+                    self._spawn(entry, self._create(api_key, entry))
+            elif entry.expires_at - now < self.refresh_margin:
+                self._spawn(entry, self._refresh(api_key, entry))
+
+        if entry.cached_config is not None and now < entry.expires_at:
+            metrics.increment('prompt_cache_requests_total', result='cached')
+            return entry.cached_config
+        metrics.increment('prompt_cache_requests_total', result='inline')
+        return config
+
+    def invalidate(self, api_key, config, error=None):
+        """请求引用的缓存已失效(如被删除或过期)，之后重新创建"""
+        entry = self._entries.get((api_key, id(config)))
+        if entry is None:
+            return
+        logger.warning(
+            f"Prompt cache rejected by Gemini API, falling back to inline prompt",
+            cache_name=entry.name,
+            error_message=str(error) if error else None
+        )
+        entry.name = None
+        entry.cached_config = None
+        entry.expires_at = 0.0
+
+    def _spawn(self, entry, coro):
+        entry.task = asyncio.ensure_future(coro)
+        entry.task.add_done_callback(lambda _: setattr(entry, 'task', None))
+
+    async def _create(self, api_key, entry):
+        # 有效期从发出请求时算起，本地记录的过期时间不会晚于服务端
+        started_at = self._clock()
+        try:
+            cached = await self._get_client(api_key).aio.caches.create(
+                model=self.model,
+                config=types.CreateCachedContentConfig(
+                    system_instruction=entry.config.system_instruction,
+                    ttl=f"{int(self.ttl)}s",
+                    display_name='room-analysis-system-prompt'
+                )
+            )
+        except Exception as e:
+            entry.retry_at = self._clock() + self.retry_seconds
+            metrics.increment('prompt_cache_operations_total', operation='create', result='failed')
+            logger.warning(
+                f"Prompt cache unavailable, using inline prompt",
+                error_type=type(e).__name__,
+                error_message=str(e),
+                retry_in=f"{self.retry_seconds}s"
+            )
+            return
+
+        entry.name = cached.name
+        entry.cached_config = entry.config.model_copy(
+            update={'system_instruction': None, 'cached_content': cached.name}
+        )
+        entry.expires_at = started_at + self.ttl
+        metrics.increment('prompt_cache_operations_total', operation='create', result='ok')
+        logger.info(
+            f"Prompt cache created",
+            cache_name=cached.name,
+            ttl=f"{self.ttl}s",
+            cached_tokens=getattr(cached.usage_metadata, 'total_token_count', None)
+        )
+
+    async def _refresh(self, api_key, entry):
+        started_at = self._clock()
+        try:
+            await self._get_client(api_key).aio.caches.update(
+                name=entry.name,
+                config=types.UpdateCachedContentConfig(ttl=f"{int(self.ttl)}s")
+            )
+        except Exception as e:
+            # 续期失败时在过期前继续使用，过期后重新创建
+            metrics.increment('prompt_cache_operations_total', operation='refresh', result='failed')
+            logger.warning(
+                f"Prompt cache refresh failed",
+                cache_name=entry.name,
+                error_type=type(e).__name__,
+                error_message=str(e)
+            )
+            return
+        entry.expires_at = started_at + self.ttl
+        metrics.increment('prompt_cache_operations_total', operation='refresh', result='ok')
+
+    def close(self):
+        """停止后台任务并清空缓存记录(Gemini端的缓存到期后自动删除)"""
+        for entry in self._entries.values():
+            if entry.task is not None:
+                entry.task.cancel()
+        self._entries = {}
+
+    def snapshot(self):
+        now = self._clock()
+        return [
+            {
+                'key_suffix': api_key[-4:],
+                'cache_name': entry.name,
+                'expires_in': round(entry.expires_at - now, 1) if entry.name else None
+            }
+            for (api_key, _), entry in self._entries.items()
+        ]
+
+
+# 创建全局系统提示词缓存
+prompt_cache = PromptCache(
+    settings.GEMINI_MODEL,
+    ttl=settings.PROMPT_CACHE_TTL,
+    refresh_margin=settings.PROMPT_CACHE_REFRESH_MARGIN,
+    retry_seconds=settings.PROMPT_CACHE_RETRY_SECONDS
+)
@@ -0,0 +1,49 @@
+from google.genai import types
+from ..schemas.requests import RoomDescription, ROOM_TYPES
+
+# Gemini提示词定义
+
+# 详细分析提示词(包含房间类型和描述)
+DETAILED_PROMPT = """Analyze the provided image and determine if it is a room, then provide a structured description.\n\nDefinition:\nA \"room\" is defined as an interior space within a building, intended for human occupancy or activity.\n\nRoom Types:\n[\"客厅\", \"家庭室\", \"餐厅\", \"厨房\", \"主卧室\", \"卧室\", \"客房\", \"卫生间\", \"浴室\", \"书房\", \"家庭办公室\", \"洗衣房\", \"储藏室\", \"食品储藏间\", \"玄关\", \"门厅\", \"走廊\", \"阳台\", \"地下室\", \"阁楼\", \"健身房\", \"家庭影院\", \"游戏室\", \"娱乐室\", \"其他\"]\n\nRules:\n1. Analyze the content of the image carefully.\n2. Determine if the image matches the definition of a \"room\".\n3. If it's a room, identify the room type from the list above.\n4. You MUST return ONLY a valid JSON object in the following format:\n{\n    \"is_room\": true/false,\n    \"room_type\": \"房型名称（从列表中选一个）\",\n    \"basic_info\": \"基本信息：精炼描述整体风格与布局\",\n    \"features\": \"特点：用最精炼的语言一句话描述最显著特点\"\n}\n\nDescription Guidelines:\n- room_type: 必须从提供的房型列表中选择一个，如果不匹配任何类型则选择\"其他\"\n- basic_info: 侧重整体风格与布局，用精炼语言描述\n- features: 用一句话描述最显著的特点\n\nIMPORTANT: Return ONLY the JSON object, no other text or explanation."""
+
+# 基础分析提示词(仅判断是否为房间)
+BASIC_PROMPT = """Analyze the provided image and determine if it is a room.\n\nDefinition:\nA \"room\" is defined as an interior space within a building, intended for human occupancy or activity.\n\nRules:\n1. Analyze the content of the image carefully.\n2. Determine if the image matches the definition of a \"room\".\n3. You MUST return ONLY a valid JSON object in the following format:\n{\n    \"is_room\": true/false\n}\n\nIMPORTANT: Return ONLY the JSON object, no other text or explanation."""
+
+
+def get_system_prompt(include_description):
+    """根据分析模式返回对应的系统提示词"""
+    return DETAILED_PROMPT if include_description else BASIC_PROMPT
+
+
+# 批量分析附加提示词(一次请求包含多张图片)
+BATCH_PROMPT_SUFFIX = """\n\nBatch Mode:\nYou will receive multiple images in one request. Each image is preceded by a text part \"Image index: N\".\nApply the rules above to every image independently.\nInstead of a single JSON object, you MUST return ONLY a valid JSON array containing exactly one object per image, in the format described above plus an integer \"index\" field matching the image index, e.g. [{\"index\": 0, \"is_room\": true, ...}, {\"index\": 1, \"is_room\": false, ...}].\n\nIMPORTANT: Return ONLY the JSON array, no other text or explanation."""
+
+
+def get_batch_system_prompt(include_description):
+    """返回批量分析模式的系统提示词"""
+    return get_system_prompt(include_description) + BATCH_PROMPT_SUFFIX
+
+
+def get_response_schema(include_description):
+    """根据RoomDescription字段和房间类型枚举构建单图响应的JSON Schema"""
+    properties = {'is_room': types.Schema(type=types.Type.BOOLEAN)}
+    if include_description:
+        for field_name in RoomDescription.model_fields:
+            properties[field_name] = types.Schema(type=types.Type.STRING)
+        properties['room_type'] = types.Schema(type=types.Type.STRING, enum=ROOM_TYPES)
+
+    return types.Schema(
+        type=types.Type.OBJECT,
+        properties=properties,
+        required=list(properties),
+        property_ordering=list(properties)
+    )
+
+
+def get_batch_response_schema(include_description):
+    """构建批量响应的JSON Schema(带index字段的对象数组)"""
+    item_schema = get_response_schema(include_description)
+    item_schema.properties = {'index': types.Schema(type=types.Type.INTEGER), **item_schema.properties}
+    item_schema.required = list(item_schema.properties)
+    item_schema.property_ordering = list(item_schema.properties)
+    return types.Schema(type=types.Type.ARRAY, items=item_schema)
@@ -0,0 +1,176 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from ..core.logging import logger
+from ..core.config import settings
+from ..core.metrics import metrics
+from .prompts import get_system_prompt, get_response_schema
+
+
+def get_analysis_version(include_description):
+    """根据模型、提示词和响应Schema计算分析版本，变更后旧缓存自动失效"""
+    fingerprint = "|".join([
+        settings.GEMINI_MODEL,
+        get_system_prompt(include_description),
+        get_response_schema(include_description).model_dump_json(exclude_none=True)
+    ])
+    return hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()[:12]
+
+
+class ResultCache:
+    """按图片内容哈希缓存分析结果(内存LRU + 可选的SQLite持久层)"""
+
+    def __init__(self, max_entries, ttl, db_path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._versions = {}
+
+    def make_key(self, image_bytes, include_description):
+        """生成缓存键: 图片内容哈希 + 分析模式 + 模型/提示词版本"""
+        mode = bool(include_description)
+        version = self._versions.get(mode)
+        if version is None:
+            version = self._versions[mode] = get_analysis_version(mode)
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        return f"{digest}:{'desc' if mode else 'basic'}:{version}"
+
+    def get(self, key):
+        """查询缓存，命中返回(is_room, description)，未命中返回None"""
+        value = self._memory_get(key)
+        if value is None and self.db_path:
+            value = self._disk_get(key)
+        if value is None:
+            metrics.increment('result_cache_total', result='miss')
+        return value
+
+    def set(self, key, value):
+        """写入缓存"""
+        expires_at = time.time() + self.ttl
+        self._memory_set(key, value, expires_at)
+        if self.db_path:
+            self._db_set(key, value, expires_at)
+
+    async def aget(self, key):
+        """异步查询，只有内存未命中且启用了SQLite时才切换到线程"""
+        value = self._memory_get(key)
+        if value is None and self.db_path:
+            value = await asyncio.to_thread(self._disk_get, key)
+        if value is None:
+            metrics.increment('result_cache_total', result='miss')
+        return value
+
+    async def aset(self, key, value):
+        """异步写入"""
+        expires_at = time.time() + self.ttl
+        self._memory_set(key, value, expires_at)
+        if self.db_path:
+            await asyncio.to_thread(self._db_set, key, value, expires_at)
+
+    def _memory_get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= now:
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+        metrics.increment('result_cache_total', result='hit_memory')
+        return value
+
+    def _disk_get(self, key):
+        row = self._db_get(key, time.time())
+        if row is None:
+            return None
+        value, expires_at = row
+        self._memory_set(key, value, expires_at)
+        metrics.increment('result_cache_total', result='hit_disk')
+        return value
+
+    def _memory_set(self, key, value, expires_at):
+        with self._lock:
+            self._memory[key] = (value, expires_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+            metrics.set_gauge('result_cache_memory_entries', len(self._memory))
+
+    def _connect(self):
+        """打开SQLite连接(WAL模式，允许同一主机上的多个worker共享)"""
+        if self._db is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS result_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            # 启动时清理过期记录
+            self._db.execute("DELETE FROM result_cache WHERE expires_at <= ?", (time.time(),))
+            self._db.commit()
+        return self._db
+
+    def _db_get(self, key, now):
+        try:
+            with self._db_lock:
+                row = self._connect().execute(
+                    "SELECT value, expires_at FROM result_cache WHERE key = ? AND expires_at > ?",
+                    (key, now)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(
+                f"Result cache read failed",
+                error_type=type(e).__name__,
+                error_message=str(e)
+            )
+            return None
+        if row is None:
+            return None
+        is_room, description = json.loads(row[0])
+        return (is_room, description), row[1]
+
+    def _db_set(self, key, value, expires_at):
+        try:
+            with self._db_lock:
+                db = self._connect()
+                db.execute(
+                    "INSERT OR REPLACE INTO result_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), expires_at)
+                )
+                db.commit()
+        except sqlite3.Error as e:
+            logger.warning(
+                f"Result cache write failed",
+                error_type=type(e).__name__,
+                error_message=str(e)
+            )
+
+    def close(self):
+        """关闭SQLite连接"""
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+# 创建全局结果缓存
+result_cache = ResultCache(
+    max_entries=settings.RESULT_CACHE_MAX_ENTRIES,
+    ttl=settings.RESULT_CACHE_TTL,
+    db_path=settings.RESULT_CACHE_DB_PATH or None
+)
@@ -0,0 +1,161 @@
+import asyncio
+import contextlib
+import contextvars
+import time
+from collections import OrderedDict, deque
+from ..core.config import settings
+from ..core.metrics import metrics
+
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+LANES = (INTERACTIVE, BULK)
+
+# 当前请求的调度身份(客户端标识, 通道)，由接口层设置；后台创建的Task会继承
+_flow_context = contextvars.ContextVar('scheduler_flow', default=('anonymous', INTERACTIVE))
+
+
+def set_flow(flow, lane):
+    """设置当前请求的客户端标识和通道"""
+    _flow_context.set((flow or 'anonymous', lane if lane in LANES else INTERACTIVE))
+
+
+def current_flow():
+    return _flow_context.get()
+
+
+class _Lane:
+    """一个优先级通道: 按客户端轮转排队"""
+
+    def __init__(self, name, weight):
+        self.name = name
+        self.weight = weight
+        self.deficit = 0
+        self.waiting = 0
+        self._flows = OrderedDict()
+
+    def push(self, flow, future):
+        self._flows.setdefault(flow, deque()).append(future)
+        self.waiting += 1
+
+    def pop(self):
+        """轮流从各客户端队列取出一个等待者"""
+        flow, queue = next(iter(self._flows.items()))
+        future = queue.popleft()
+        if queue:
+            self._flows.move_to_end(flow)
+        else:
+            del self._flows[flow]
+        self.waiting -= 1
+        return future
+
+    def remove(self, flow, future):
+        queue = self._flows.get(flow)
+        if queue is None or future not in queue:
+            return
+        queue.remove(future)
+        if not queue:
+            del self._flows[flow]
+        self.waiting -= 1
+
+
+class FairScheduler:
+    """加权公平的并发槽位调度器(替代全局FIFO信号量)
+
+    通道之间按权重做差额轮询(DRR): 每轮interactive通道可获得weight个槽位，bulk通道获得自己的weight个；
+    通道内按客户端轮转，单个客户端的大批量请求不会挡住其他客户端。
+    """
+
+    def __init__(self, name, capacity, lane_weights):
+        self.name = name
+        self.capacity = capacity
+        self.in_use = 0
+        self._lanes = [_Lane(lane, lane_weights[lane]) for lane in LANES]
+        self._lanes_by_name = {lane.name: lane for lane in self._lanes}
+        self._turn = 0
+
+    @property
+    def waiting(self):
+        return sum(lane.waiting for lane in self._lanes)
+
+    def lane_waiting(self, lane):
+        return self._lanes_by_name[lane].waiting
+
+    async def acquire(self, flow=None, lane=None):
+        """获取一个槽位，未指定时使用当前请求的调度身份"""
+        if flow is None or lane is None:
+            flow, lane = current_flow()
+        start_time = time.perf_counter()
+        if self.in_use < self.capacity and not self.waiting:
+            self.in_use += 1
+        else:
+            target = self._lanes_by_name[lane]
+            future = asyncio.get_running_loop().create_future()
+            target.push(flow, future)
+            self._update_gauges(target)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # 槽位已分配但调用者被取消，归还
+                    self.release()
+                else:
+                    target.remove(flow, future)
+                    self._update_gauges(target)
+                raise
+        metrics.increment('scheduler_grants_total', scheduler=self.name, lane=lane)
+        metrics.observe(
+            'scheduler_wait_seconds', time.perf_counter() - start_time,
+            scheduler=self.name, lane=lane
+        )
+
+    def release(self):
+        self.in_use -= 1
+        self._dispatch()
+
+    def set_capacity(self, capacity):
+        """调整槽位数: 增大时立即唤醒等待者，减小时已占用的槽位归还后才生效"""
+        self.capacity = max(1, capacity)
+        metrics.set_gauge('scheduler_capacity', self.capacity, scheduler=self.name)
+        self._dispatch()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, flow=None, lane=None):
+        await self.acquire(flow, lane)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def _dispatch(self):
+        while self.in_use < self.capacity and self.waiting:
+            lane = self._next_lane()
+            future = lane.pop()
+            self._update_gauges(lane)
+            if future.done():
+                continue
+            self.in_use += 1
+            future.set_result(None)
+
+    def _next_lane(self):
+        """差额轮询: 当前通道额度用完或没有等待者时轮到下一个通道，并补充其额度"""
+        while True:
+            lane = self._lanes[self._turn]
+            if lane.waiting and lane.deficit >= 1:
+                lane.deficit -= 1
+                return lane
+            if not lane.waiting:
+                lane.deficit = 0
+            self._turn = (self._turn + 1) % len(self._lanes)
+            following = self._lanes[self._turn]
+            if following.waiting:
+                following.deficit += following.weight
+
+    def _update_gauges(self, lane):
+        metrics.set_gauge('scheduler_waiting', lane.waiting, scheduler=self.name, lane=lane.name)
+
+
+LANE_WEIGHTS = {
+    INTERACTIVE: max(1, settings.FAIR_INTERACTIVE_WEIGHT),
+    BULK: max(1, settings.FAIR_BULK_WEIGHT)
+}
@@ -0,0 +1,52 @@
+import asyncio
+from ..core.metrics import metrics
+
+
+class _Flight:
+    """一次正在进行的共享调用"""
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """合并相同键的并发调用: 第一个调用者执行，其余调用者等待同一个结果
+
+    实际工作在独立的Task中运行，单个调用者被取消不会影响其他等待者；
+    只有所有等待者都取消时才取消实际工作。
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._flights = {}
+
+    def __len__(self):
+        return len(self._flights)
+
+    async def do(self, key, func, *args, **kwargs):
+        """执行func(*args, **kwargs)或等待相同键的进行中调用"""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(func(*args, **kwargs)))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+            metrics.increment('single_flight_total', flight=self.name, role='leader')
+        else:
+            metrics.increment('single_flight_total', flight=self.name, role='follower')
+        metrics.set_gauge('single_flight_in_flight', len(self._flights), flight=self.name)
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.task.done():
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def _forget(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        metrics.set_gauge('single_flight_in_flight', len(self._flights), flight=self.name)
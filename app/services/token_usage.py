@@ -0,0 +1,120 @@
+import contextvars
+import math
+from collections import OrderedDict
+from ..core.config import settings
+from ..core.metrics import metrics
+from ..utils.image_processing import read_image_size
+from .scheduler import current_flow
+
+
+# Gemini图片计费: 两边都不超过384像素时计258个token，否则按768×768切块，每块258个token
+IMAGE_TILE_TOKENS = 258
+IMAGE_SMALL_EDGE = 384
+IMAGE_TILE_EDGE = 768
+
+# 按客户端累计用量时保留的客户端数
+MAX_TRACKED_CLIENTS = 10000
+
+
+def estimate_image_tokens(image_data):
+    """根据(预处理后)图片的像素尺寸估计输入token数，无法读取尺寸时按一块计"""
+    size = read_image_size(image_data) if image_data else None
+    if size is None:
+        return IMAGE_TILE_TOKENS
+    width, height = size
+    if width <= IMAGE_SMALL_EDGE and height <= IMAGE_SMALL_EDGE:
+        return IMAGE_TILE_TOKENS
+    return math.ceil(width / IMAGE_TILE_EDGE) * math.ceil(height / IMAGE_TILE_EDGE) * IMAGE_TILE_TOKENS
+
+
+def estimate_call_tokens(images):
+    """估计一次调用的总token数: 各图片的token数 + 系统提示词和输出的预计token数"""
+    return settings.GEMINI_PROMPT_TOKENS_ESTIMATE + sum(estimate_image_tokens(data) for data in images)
+
+
+class TokenUsage:
+    """一个请求(或一个客户端)累计的Gemini用量"""
+
+    def __init__(self):
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.calls = 0
+
+    def add(self, input_tokens, output_tokens, calls):
+        self.input_tokens += input_tokens
+        self.output_tokens += output_tokens
+        self.calls += calls
+
+    def to_dict(self):
+        return {
+            'input_tokens': self.input_tokens,
+            'output_tokens': self.output_tokens,
+            'total_tokens': self.input_tokens + self.output_tokens,
+            # 批量调用按图片数分摊，因此可能是小数
+            'calls': round(self.calls, 3)
+        }
+
+
+# 当前请求的用量，由接口层创建；后台创建的Task会继承
+_usage_context = contextvars.ContextVar('token_usage', default=None)
+
+
+def start_usage_tracking():
+    """为当前请求创建用量记录并返回"""
+    usage = TokenUsage()
+    _usage_context.set(usage)
+    return usage
+
+
+def current_usage():
+    return _usage_context.get()
+
+
+class UsageLedger:
+    """按客户端累计Gemini用量(只保留最近活跃的客户端)"""
+
+    def __init__(self, max_clients):
+        self.max_clients = max_clients
+        self._clients = OrderedDict()
+
+    def record(self, usage_metadata, share=1.0, request_usage=None, flow=None):
+        """记录一次调用(批量调用中的一张图片按share分摊)的实际用量，返回(输入token, 输出token)"""
+        if usage_metadata is None:
+            return 0, 0
+        input_tokens = round((usage_metadata.prompt_token_count or 0) * share)
+        output_tokens = round((usage_metadata.candidates_token_count or 0) * share)
+        if flow is None:
+            flow = current_flow()
+        client, lane = flow
+
+        if request_usage is not None:
+            request_usage.add(input_tokens, output_tokens, share)
+        client_usage = self._clients.get(client)
+        if client_usage is None:
+            client_usage = self._clients[client] = TokenUsage()
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+        else:
+            self._clients.move_to_end(client)
+        client_usage.add(input_tokens, output_tokens, share)
+
+        metrics.increment('gemini_tokens_total', input_tokens, direction='input', lane=lane)
+        metrics.increment('gemini_tokens_total', output_tokens, direction='output', lane=lane)
+        # 输入token中命中上下文缓存的部分(按缓存价格计费)
+        cached_tokens = round((getattr(usage_metadata, 'cached_content_token_count', None) or 0) * share)
+        if cached_tokens:
+            metrics.increment('gemini_tokens_total', cached_tokens, direction='cached_input', lane=lane)
+        return input_tokens, output_tokens
+
+    def snapshot(self, limit=100):
+        """用量最多的limit个客户端"""
+        ranked = sorted(
+            self._clients.items(),
+            key=lambda item: item[1].input_tokens + item[1].output_tokens,
+            reverse=True
+        )
+        return {client: usage.to_dict() for client, usage in ranked[:limit]}
+
+
+# 创建全局客户端用量账本
+usage_ledger = UsageLedger(MAX_TRACKED_CLIENTS)
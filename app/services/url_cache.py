@@ -0,0 +1,101 @@
+import threading
+import time
+from collections import OrderedDict
+from ..core.config import settings
+from ..core.metrics import metrics
+from ..utils.url_utils import parse_cache_control
+
+
+class UrlCacheEntry:
+    """单个URL的缓存信息: 校验头、内容哈希、新鲜期和各分析模式的结果"""
+
+    def __init__(self, etag=None, last_modified=None, content_hash=None, fresh_until=0.0):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_hash = content_hash
+        self.fresh_until = fresh_until
+        self.results = {}
+
+    @property
+    def has_validators(self):
+        return bool(self.etag or self.last_modified)
+
+    def is_fresh(self, now=None):
+        return (now or time.time()) < self.fresh_until
+
+
+class UrlCache:
+    """URL级缓存，支持按Cache-Control判断新鲜度和条件请求重新验证"""
+
+    def __init__(self, max_entries, min_ttl, max_ttl):
+        self.max_entries = max_entries
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        """获取URL的缓存条目，不存在返回None"""
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None:
+                self._entries.move_to_end(url)
+            return entry
+
+    def compute_fresh_until(self, cache_control):
+        """根据Cache-Control计算新鲜期截止时间，no-store时返回None表示不缓存"""
+        directives = parse_cache_control(cache_control)
+        if 'no-store' in directives:
+            return None
+        max_age = 0 if 'no-cache' in directives else directives.get('max-age', 0)
+        ttl = min(max(max_age, self.min_ttl), self.max_ttl)
+        return time.time() + ttl
+
+    def store(self, url, include_description, result, etag=None, last_modified=None,
+              cache_control=None, content_hash=None):
+        """保存下载后的分析结果和校验头，content_hash为图片内容的哈希(与分析模式无关)"""
+        fresh_until = self.compute_fresh_until(cache_control)
+        if fresh_until is None:
+            self.invalidate(url)
+            return
+
+        with self._lock:
+            entry = self._entries.get(url)
+            # 内容或ETag发生变化时丢弃其他模式的旧结果
+            if entry is None or entry.content_hash != content_hash or entry.etag != etag:
+                entry = UrlCacheEntry(content_hash=content_hash)
+                self._entries[url] = entry
+            entry.etag = etag
+            entry.last_modified = last_modified
+            entry.fresh_until = fresh_until
+            entry.results[bool(include_description)] = result
+            self._entries.move_to_end(url)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            metrics.set_gauge('url_cache_entries', len(self._entries))
+
+    def refresh(self, url, cache_control=None, etag=None, last_modified=None):
+        """收到304后延长新鲜期(可能更新校验头)"""
+        fresh_until = self.compute_fresh_until(cache_control)
+        if fresh_until is None:
+            self.invalidate(url)
+            return
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                return
+            entry.fresh_until = fresh_until
+            entry.etag = etag or entry.etag
+            entry.last_modified = last_modified or entry.last_modified
+
+    def invalidate(self, url):
+        with self._lock:
+            self._entries.pop(url, None)
+
+
+# 创建全局URL缓存
+url_cache = UrlCache(
+    max_entries=settings.URL_CACHE_MAX_ENTRIES,
+    min_ttl=settings.URL_CACHE_MIN_TTL,
+    max_ttl=settings.URL_CACHE_MAX_TTL
+)
@@ -0,0 +1,224 @@
+import contextlib
+import time
+from collections import OrderedDict, deque
+from ..core.logging import logger
+from ..core.config import settings
+from ..core.metrics import metrics
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# 状态指标取值
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开，调用被直接拒绝"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """按最近window_size次调用的失败率和慢调用率熔断
+
+    closed: 正常放行，统计最近的调用结果；失败率或慢调用率超过阈值时转为open
+    open: 直接拒绝，open_seconds后转为half_open
+    half_open: 放行half_open_calls个探测调用，全部成功且不慢时恢复closed，否则重新open
+    """
+
+    def __init__(
+        self, name, description, window_size, min_calls, failure_rate,
+        slow_call_seconds, slow_call_rate, open_seconds, half_open_calls
+    ):
+        self.name = name
+        self.description = description
+        self.window_size = window_size
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self._state = CLOSED
+        self._outcomes = deque(maxlen=window_size)
+        self._opened_at = 0.0
+        self._last_reason = None
+        self._probes = 0
+        self._probe_successes = 0
+        self.trips = 0
+
+    @property
+    def state(self):
+        if self._state == OPEN and self._retry_after() <= 0:
+            self._transition(HALF_OPEN, self._last_reason)
+        return self._state
+
+    def _retry_after(self):
+        return self._opened_at + self.open_seconds - time.monotonic()
+
+    def acquire(self):
+        """调用前检查，熔断时抛出CircuitOpenError"""
+        state = self.state
+        if state == CLOSED:
+            return
+        if state == HALF_OPEN and self._probes < self.half_open_calls:
+            self._probes += 1
+            return
+        metrics.increment('circuit_breaker_rejected_total', breaker=self.name)
+        retry_after = max(1, round(self._retry_after()))
+        raise CircuitOpenError(
+            f"{self.description}暂时不可用(熔断中)，约{retry_after}秒后重试",
+            retry_after=retry_after
+        )
+
+    def record_success(self, latency):
+        slow = latency >= self.slow_call_seconds
+        if self._state == HALF_OPEN:
+            self._finish_probe(not slow, 'slow' if slow else None)
+            return
+        self._record(False, slow)
+
+    def record_failure(self, latency):
+        if self._state == HALF_OPEN:
+            self._finish_probe(False, 'failure')
+            return
+        self._record(True, latency >= self.slow_call_seconds)
+
+    def record_ignored(self):
+        """调用被取消(如超出请求时间预算)，不计入结果，只归还探测名额"""
+        if self._state == HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    @contextlib.asynccontextmanager
+    async def guard(self, is_failure=None):
+        """包裹一次调用: is_failure(e)为False的异常(如404)说明对方可用，按成功计"""
+        self.acquire()
+        start_time = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            latency = time.monotonic() - start_time
+            if is_failure is None or is_failure(e):
+                self.record_failure(latency)
+            else:
+                self.record_success(latency)
+            raise
+        except BaseException:
+            self.record_ignored()
+            raise
+        else:
+            self.record_success(time.monotonic() - start_time)
+
+    def _record(self, failed, slow):
+        self._outcomes.append((failed, slow))
+        if len(self._outcomes) < self.min_calls:
+            return
+        count = len(self._outcomes)
+        failures = sum(1 for failed, _ in self._outcomes if failed)
+        slow_calls = sum(1 for _, slow in self._outcomes if slow)
+        if failures / count >= self.failure_rate:
+            self._transition(OPEN, 'failure')
+        elif slow_calls / count >= self.slow_call_rate:
+            self._transition(OPEN, 'slow')
+
+    def _finish_probe(self, healthy, reason):
+        if not healthy:
+            self._transition(OPEN, reason)
+            return
+        self._probe_successes += 1
+        if self._probe_successes >= self.half_open_calls:
+            self._transition(CLOSED, None)
+
+    def _transition(self, state, reason):
+        old_state = self._state
+        self._state = state
+        self._last_reason = reason
+        self._probes = 0
+        self._probe_successes = 0
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+            self.trips += 1
+        self._outcomes.clear()
+
+        metrics.increment('circuit_breaker_transitions_total', breaker=self.name, to=state)
+        metrics.set_gauge('circuit_breaker_state', STATE_VALUES[state], breaker=self.name)
+        log = logger.warning if state == OPEN else logger.info
+        log(
+            f"Circuit breaker state changed",
+            breaker=self.name,
+            old_state=old_state,
+            new_state=state,
+            reason=reason
+        )
+
+    def snapshot(self):
+        state = self.state
+        failures = sum(1 for failed, _ in self._outcomes if failed)
+        slow_calls = sum(1 for _, slow in self._outcomes if slow)
+        return {
+            'state': state,
+            'reason': self._last_reason,
+            'retry_after': max(0, round(self._retry_after(), 1)) if state == OPEN else None,
+            'window_calls': len(self._outcomes),
+            'window_failures': failures,
+            'window_slow_calls': slow_calls,
+            'trips': self.trips
+        }
+
+
+class HostBreakers:
+    """按图片主机划分的熔断器，只保留最近使用的max_hosts个主机"""
+
+    def __init__(self, max_hosts):
+        self.max_hosts = max_hosts
+        self._breakers = OrderedDict()
+
+    def get(self, host):
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            breaker = self._breakers[host] = CircuitBreaker(
+                f'download:{host}',
+                f"图片主机 {host} ",
+                window_size=settings.BREAKER_WINDOW_SIZE,
+                min_calls=settings.BREAKER_MIN_CALLS,
+                failure_rate=settings.BREAKER_FAILURE_RATE,
+                slow_call_seconds=settings.BREAKER_DOWNLOAD_SLOW_SECONDS,
+                slow_call_rate=settings.BREAKER_SLOW_CALL_RATE,
+                open_seconds=settings.BREAKER_OPEN_SECONDS,
+                half_open_calls=settings.BREAKER_HALF_OPEN_CALLS
+            )
+            while len(self._breakers) > self.max_hosts:
+                self._breakers.popitem(last=False)
+        else:
+            self._breakers.move_to_end(host)
+        return breaker
+
+    def snapshot(self):
+        """只列出未处于closed状态的主机"""
+        return {
+            'tracked_hosts': len(self._breakers),
+            'hosts': {
+                host: breaker.snapshot()
+                for host, breaker in self._breakers.items()
+                if breaker.state != CLOSED
+            }
+        }
+
+
+# 创建全局熔断器: Gemini模型后端一个，图片下载按主机各一个
+gemini_breaker = CircuitBreaker(
+    'gemini',
+    "Gemini服务",
+    window_size=settings.BREAKER_WINDOW_SIZE,
+    min_calls=settings.BREAKER_MIN_CALLS,
+    failure_rate=settings.BREAKER_FAILURE_RATE,
+    slow_call_seconds=settings.BREAKER_GEMINI_SLOW_SECONDS,
+    slow_call_rate=settings.BREAKER_SLOW_CALL_RATE,
+    open_seconds=settings.BREAKER_OPEN_SECONDS,
+    half_open_calls=settings.BREAKER_HALF_OPEN_CALLS
+)
+host_breakers = HostBreakers(settings.BREAKER_MAX_HOSTS)
@@ -0,0 +1,85 @@
+import asyncio
+import contextlib
+from ..core.config import settings
+from ..core.metrics import metrics
+
+
+class DeadlineExceeded(Exception):
+    """处理阶段超出请求的时间预算"""
+
+    def __init__(self, stage):
+        super().__init__(f"处理超时: {STAGE_NAMES.get(stage, stage)}阶段超出请求时间预算")
+        self.stage = stage
+
+
+STAGE_NAMES = {
+    'queue': '排队',
+    'download': '下载',
+    'analysis': '分析'
+}
+
+
+class Deadline:
+    """请求级时间预算，每张图片开始处理时按比例划分排队、下载和分析阶段
+
+    阶段截止点从图片开始处理时算起，按当时剩余的预算分配，且是累积的: 排队在剩余时间的 queue_share
+    处截止，下载在 queue_share + download_share 处截止，分析在请求到期时截止。
+    前面的阶段提前完成时，节省的时间留给后面的阶段；批次中较晚开始的图片按剩余时间等比缩短各阶段。
+    """
+
+    def __init__(self, timeout, queue_share, download_share, expires_at=None):
+        self.timeout = timeout
+        self.queue_share = queue_share
+        self.download_share = download_share
+        now = asyncio.get_running_loop().time()
+        self.expires_at = now + timeout if expires_at is None else expires_at
+        self._checkpoints = self._plan(now)
+
+    def _plan(self, start):
+        budget = max(0.0, self.expires_at - start)
+        return {
+            'queue': start + budget * self.queue_share,
+            'download': start + budget * min(self.queue_share + self.download_share, 1.0),
+            'analysis': self.expires_at
+        }
+
+    def for_item(self):
+        """为开始处理的一张图片创建截止时间: 请求到期时间不变，阶段截止点从现在起按剩余时间划分"""
+        return Deadline(self.timeout, self.queue_share, self.download_share, expires_at=self.expires_at)
+
+    @classmethod
+    def from_ms(cls, deadline_ms=None):
+        """根据请求的deadline_ms(未指定时使用服务器默认值)创建，预算为0表示不限时，返回None"""
+        if deadline_ms is None:
+            deadline_ms = settings.REQUEST_DEADLINE_MS
+        if not deadline_ms or deadline_ms <= 0:
+            return None
+        return cls(
+            min(deadline_ms, settings.MAX_DEADLINE_MS) / 1000,
+            settings.DEADLINE_QUEUE_SHARE,
+            settings.DEADLINE_DOWNLOAD_SHARE
+        )
+
+    def remaining(self):
+        return max(0.0, self.expires_at - asyncio.get_running_loop().time())
+
+    @property
+    def expired(self):
+        return self.remaining() <= 0
+
+    @contextlib.asynccontextmanager
+    async def stage(self, name):
+        """在阶段截止点取消阶段内的操作，并转换为DeadlineExceeded"""
+        try:
+            async with asyncio.timeout_at(self._checkpoints[name]):
+                yield
+        except TimeoutError:
+            metrics.increment('deadline_exceeded_total', stage=name)
+            raise DeadlineExceeded(name) from None
+
+
+def deadline_stage(deadline, name):
+    """deadline为None时不限时"""
+    if deadline is None:
+        return contextlib.nullcontext()
+    return deadline.stage(name)
@@ -0,0 +1,78 @@
+from ..core.metrics import metrics
+
+
+# 嗅探格式所需的最少字节数
+SNIFF_BYTES = 32
+
+# HEIF容器(ftyp box)中的品牌标识
+HEIC_BRANDS = {b'heic', b'heix', b'hevc', b'hevx', b'heim', b'heis'}
+HEIF_BRANDS = {b'mif1', b'msf1'}
+
+
+class ImageIngestError(Exception):
+    """图片数据不合法(非图片或超出大小限制)"""
+
+    def __init__(self, message, reason):
+        super().__init__(message)
+        self.reason = reason
+
+
+def sniff_image_mime_type(head):
+    """根据文件头魔数识别图片格式，无法识别时返回None"""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if head.startswith((b'GIF87a', b'GIF89a')):
+        return 'image/gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head.startswith(b'BM'):
+        return 'image/bmp'
+    if head.startswith((b'II*\x00', b'MM\x00*')):
+        return 'image/tiff'
+    if head[4:8] == b'ftyp':
+        brand = head[8:12]
+        if brand in HEIC_BRANDS:
+            return 'image/heic'
+        if brand in HEIF_BRANDS:
+            return 'image/heif'
+    return None
+
+
+class ImageIngest:
+    """流式接收图片数据: 读到文件头即嗅探真实格式，超出大小限制立即中止"""
+
+    def __init__(self, max_bytes, expected_size=None):
+        self.max_bytes = max_bytes
+        self.mime_type = None
+        self._buffer = bytearray()
+        if expected_size is not None and expected_size > max_bytes:
+            self._reject(f"图片过大: {expected_size}字节，超过限制{max_bytes}字节", 'too_large')
+
+    @property
+    def size(self):
+        return len(self._buffer)
+
+    def feed(self, chunk):
+        """追加一块数据"""
+        if len(self._buffer) + len(chunk) > self.max_bytes:
+            self._reject(f"图片过大: 超过限制{self.max_bytes}字节", 'too_large')
+        self._buffer.extend(chunk)
+        if self.mime_type is None and len(self._buffer) >= SNIFF_BYTES:
+            self._sniff()
+
+    def finish(self):
+        """结束接收，返回(图片字节, 嗅探得到的MIME类型)"""
+        if self.mime_type is None:
+            self._sniff()
+        return bytes(self._buffer), self.mime_type
+
+    def _sniff(self):
+        self.mime_type = sniff_image_mime_type(bytes(self._buffer[:SNIFF_BYTES]))
+        if self.mime_type is None:
+            self._reject("数据不是支持的图片格式(JPEG/PNG/GIF/WebP/BMP/TIFF/HEIC)", 'not_image')
+
+    def _reject(self, message, reason):
+        metrics.increment('image_ingest_rejected_total', reason=reason)
+        raise ImageIngestError(message, reason)
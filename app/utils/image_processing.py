@@ -0,0 +1,101 @@
+import io
+import time
+from PIL import Image, ImageOps
+
+
+# 无需转换即可直接发送给Gemini的格式
+PASSTHROUGH_FORMATS = {'JPEG', 'PNG', 'WEBP'}
+
+OUTPUT_MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'WEBP': 'image/webp'
+}
+
+
+def preprocess_image_bytes(data, max_edge, output_format='JPEG', quality=85):
+    """缩放并重新编码图片(在进程池中运行)
+
+    - JPEG使用draft模式按比例快速解码
+    - 动图只取第一帧
+    - TIFF/BMP等格式转换为JPEG/WebP
+    - 重新编码时去除EXIF等元数据(先按EXIF方向旋转)
+
+    返回(图片字节, MIME类型或None, 统计信息)，MIME类型为None表示保留原图
+    """
+    start_time = time.perf_counter()
+    with Image.open(io.BytesIO(data)) as image:
+        source_format = image.format
+        original_size = image.size
+        is_animated = getattr(image, 'is_animated', False)
+
+        if (source_format in PASSTHROUGH_FORMATS and not is_animated
+                and max(original_size) <= max_edge):
+            return data, None, {
+                'action': 'passthrough',
+                'source_format': source_format,
+                'original_size': original_size,
+                'output_size': original_size,
+                'duration': time.perf_counter() - start_time
+            }
+
+        if source_format == 'JPEG':
+            # draft模式让解码器直接输出缩小后的图像，避免完整解码大图
+            image.draft('RGB', (max_edge, max_edge))
+        if is_animated:
+            image.seek(0)
+
+        frame = ImageOps.exif_transpose(image)
+        if frame.mode in ('RGBA', 'LA') or (frame.mode == 'P' and 'transparency' in frame.info):
+            background = Image.new('RGB', frame.size, (255, 255, 255))
+            background.paste(frame.convert('RGBA'), mask=frame.convert('RGBA').split()[-1])
+            frame = background
+        elif frame.mode != 'RGB':
+            frame = frame.convert('RGB')
+
+        if max(frame.size) > max_edge:
+            frame.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS, reducing_gap=2.0)
+
+        output = io.BytesIO()
+        frame.save(output, format=output_format, quality=quality, optimize=output_format == 'JPEG')
+        processed = output.getvalue()
+
+    return processed, OUTPUT_MIME_TYPES[output_format], {
+        'action': 'reencoded',
+        'source_format': source_format,
+        'original_size': original_size,
+        'output_size': frame.size,
+        'duration': time.perf_counter() - start_time
+    }
+
+
+def compute_dhash(data, hash_size=8):
+    """计算图片的差值哈希(dHash)，返回hash_size*hash_size位整数
+
+    缩放为(hash_size+1)×hash_size的灰度图，比较每行相邻像素的亮度。
+    对缩放、重新压缩和轻微水印不敏感。
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        if image.format == 'JPEG':
+            image.draft('L', (hash_size * 8, hash_size * 8))
+        if getattr(image, 'is_animated', False):
+            image.seek(0)
+        small = ImageOps.exif_transpose(image).convert('L').resize(
+            (hash_size + 1, hash_size), Image.Resampling.LANCZOS
+        )
+        pixels = list(small.getdata())
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def read_image_size(data):
+    """只解析文件头读取图片尺寸(宽, 高)，无法识别时返回None"""
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            return image.size
+    except Exception:
+        return None
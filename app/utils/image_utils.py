@@ -1,106 +1,216 @@
-import base64
+import asyncio
 import time
-import requests
+import aiohttp
 import traceback
+from urllib.parse import urlparse
+from dataclasses import dataclass
+from typing import Optional
 from ..core.logging import logger
 from ..core.config import settings
-from .url_utils import is_valid_image_mime_type, is_likely_image_url
-from ..utils.decorators import monitor_performance
+from .image_format import ImageIngest
+from .circuit_breaker import CircuitOpenError, host_breakers
+from ..utils.decorators import monitor_async_performance
 
 
-# 全局会话对象，重用HTTP连接
-session = requests.Session()
-session.verify = False  # 禁用SSL验证（仅用于测试）
-session.headers.update({
+DEFAULT_HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-})
+}
 
+# 全局会话对象，重用HTTP连接(按主机限制连接数并缓存DNS)
+_session = None
 
-@monitor_performance("Image Download")
-def download_image(url, request_id='unknown'):
-    """下载图片并返回base64编码的数据和MIME类型"""
-    try:
+
+def get_download_session():
+    """获取共享的aiohttp会话，首次调用时创建(必须在事件循环中调用)"""
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=settings.DOWNLOAD_POOL_SIZE,
+            limit_per_host=settings.DOWNLOAD_POOL_PER_HOST,
+            ttl_dns_cache=settings.DOWNLOAD_DNS_CACHE_TTL,
+            keepalive_timeout=settings.DOWNLOAD_KEEPALIVE_TIMEOUT,
+            ssl=False  # 禁用SSL验证（仅用于测试）
+        )
+        _session = aiohttp.ClientSession(
+            connector=connector,
+            headers=DEFAULT_HEADERS,
+            timeout=aiohttp.ClientTimeout(
+                total=settings.DOWNLOAD_TIMEOUT,
+                connect=settings.DOWNLOAD_CONNECT_TIMEOUT,
+                sock_read=settings.DOWNLOAD_READ_TIMEOUT
+            )
+        )
         logger.info(
-            f"Starting image download",
+            f"Download session initialized",
+            pool_size=settings.DOWNLOAD_POOL_SIZE,
+            pool_per_host=settings.DOWNLOAD_POOL_PER_HOST,
+            dns_cache_ttl=settings.DOWNLOAD_DNS_CACHE_TTL
+        )
+    return _session
+
+
+async def close_download_session():
+    """关闭共享的aiohttp会话"""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+        logger.info(f"Download session closed")
+    _session = None
+
+
+@dataclass
+class DownloadedImage:
+    """下载结果: 原始图片字节(不做base64编码)、MIME类型和缓存相关头
+
+    条件请求返回304时data和mime_type为None
+    """
+    data: Optional[bytes]
+    mime_type: Optional[str]
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    cache_control: Optional[str] = None
+
+    @property
+    def not_modified(self):
+        return self.data is None
+
+    @property
+    def size(self):
+        return len(self.data) if self.data is not None else 0
+
+    @property
+    def cache_headers(self):
+        return {
+            'etag': self.etag,
+            'last_modified': self.last_modified,
+            'cache_control': self.cache_control
+        }
+
+
+def _build_downloaded_image(response, data, mime_type):
+    """根据响应构建下载结果"""
+    return DownloadedImage(
+        data=data,
+        mime_type=mime_type,
+        etag=response.headers.get('etag'),
+        last_modified=response.headers.get('last-modified'),
+        cache_control=response.headers.get('cache-control')
+    )
+
+
+async def _handle_response(response, url, request_id, start_time, lease=None):
+    """校验响应并读取图片数据"""
+    if response.status == 304:
+        logger.info(
+            f"Image not modified, reusing cached result",
             request_id=request_id,
             url=url,
-            timeout=settings.DOWNLOAD_TIMEOUT
+            duration=f"{time.time() - start_time:.3f}s"
         )
-        
-        start_time = time.time()
-        response = session.get(url, timeout=settings.DOWNLOAD_TIMEOUT)
-        response.raise_for_status()
-        
-        content_type = response.headers.get('content-type', '').lower()
-        content_length = response.headers.get('content-length', 'unknown')
-        
-        logger.debug(
-            f"Received response",
+        return _build_downloaded_image(response, None, None)
+    response.raise_for_status()
+
+    header_content_type = response.headers.get('content-type', '').lower()
+    content_length = response.headers.get('content-length', 'unknown')
+
+    logger.debug(
+        f"Received response",
+        request_id=request_id,
+        url=url,
+        status_code=response.status,
+        content_type=header_content_type,
+        content_length=content_length
+    )
+
+    # 检查是否为HTML页面(无需读取响应体即可拒绝)
+    if 'text/html' in header_content_type:
+        error_msg = "URL返回的是HTML页面，不是图片文件。请使用直接的图片URL，而不是Google搜索页面URL"
+        logger.error(
+            error_msg,
             request_id=request_id,
             url=url,
-            status_code=response.status_code,
-            content_type=content_type,
-            content_length=content_length
+            content_type=header_content_type
         )
+        raise Exception(error_msg)
 
-        # 检查是否为HTML页面
-        if 'text/html' in content_type:
-            error_msg = "URL返回的是HTML页面，不是图片文件。请使用直接的图片URL，而不是Google搜索页面URL"
-            logger.error(
-                error_msg,
-                request_id=request_id,
-                url=url,
-                content_type=content_type
-            )
-            raise Exception(error_msg)
-
-        # 使用更智能的MIME类型检查
-        if not is_valid_image_mime_type(content_type, url):
-            # 如果MIME类型不匹配，但URL看起来像图片，给出警告但继续处理
-            if is_likely_image_url(url):
-                logger.warning(
-                    f"MIME type {content_type} is not standard image type, but URL appears to be image, attempting to continue",
-                    request_id=request_id,
-                    url=url,
-                    content_type=content_type
-                )
-                # 为 application/octet-stream 设置默认图片类型
-                if content_type == 'application/octet-stream':
-                    if url.lower().endswith(('.jpg', '.jpeg')):
-                        content_type = 'image/jpeg'
-                    elif url.lower().endswith('.png'):
-                        content_type = 'image/png'
-                    elif url.lower().endswith('.gif'):
-                        content_type = 'image/gif'
-                    elif url.lower().endswith('.webp'):
-                        content_type = 'image/webp'
-                    else:
-                        content_type = 'image/jpeg'  # 默认为jpeg
-            else:
-                error_msg = f"不支持的MIME类型: {content_type}"
-                logger.error(
-                    error_msg,
-                    request_id=request_id,
-                    url=url,
-                    content_type=content_type
-                )
-                raise Exception(error_msg)
-
-        image_data = base64.b64encode(response.content).decode('utf-8')
-        download_time = time.time() - start_time
-        
+    # 流式读取: 根据文件头嗅探真实格式，非图片或超过大小限制时提前中止
+    image_bytes, content_type = await _read_body(response, lease)
+    download_time = time.time() - start_time
+
+    logger.info(
+        f"Image download completed successfully",
+        request_id=request_id,
+        url=url,
+        duration=f"{download_time:.3f}s",
+        content_type=content_type,
+        header_content_type=header_content_type,
+        data_size=len(image_bytes)
+    )
+
+    return _build_downloaded_image(response, image_bytes, content_type)
+
+
+async def _read_body(response, lease=None):
+    """分块读取响应体，返回(图片字节, 嗅探得到的MIME类型)
+
+    传入内存预算lease时，有Content-Length则读取前等待预算补足到该长度(预算不足时暂停读取，
+    补足优先于排队图片的预留，不会与它们互相等待)，没有时按已接收的数据量计入预算
+    """
+    content_length = response.content_length
+    ingest = ImageIngest(settings.MAX_IMAGE_BYTES, expected_size=content_length)
+    if lease is not None and content_length is not None:
+        await lease.top_up_to(content_length)
+    async for chunk in response.content.iter_chunked(settings.DOWNLOAD_CHUNK_SIZE):
+        ingest.feed(chunk)
+        if lease is not None:
+            lease.grow_to(ingest.size)
+    return ingest.finish()
+
+
+def _is_host_failure(error):
+    """超时、连接失败、429和5xx说明图片主机异常；404、非图片等错误与主机可用性无关"""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status == 429 or error.status >= 500
+    return isinstance(error, (asyncio.TimeoutError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError))
+
+
+@monitor_async_performance("Image Download")
+async def download_image(url, request_id='unknown', etag=None, last_modified=None, lease=None):
+    """下载图片并返回DownloadedImage
+
+    传入etag/last_modified时发送条件请求，服务器返回304时图片数据为None；
+    传入lease时图片数据计入内存预算(由调用者在处理完成后归还)；
+    图片主机熔断时直接抛出CircuitOpenError
+    """
+    try:
         logger.info(
-            f"Image download completed successfully",
+            f"Starting image download",
             request_id=request_id,
             url=url,
-            duration=f"{download_time:.3f}s",
-            content_type=content_type,
-            data_size=len(response.content)
+            timeout=settings.DOWNLOAD_TIMEOUT,
+            conditional=bool(etag or last_modified)
         )
         
-        return image_data, content_type
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+        start_time = time.time()
+        async with host_breakers.get(urlparse(url).hostname or '').guard(_is_host_failure):
+            async with get_download_session().get(url, headers=headers) as response:
+                return await _handle_response(response, url, request_id, start_time, lease)
         
-    except requests.exceptions.SSLError as e:
+    except CircuitOpenError as e:
+        logger.warning(
+            f"Image download rejected by circuit breaker",
+            request_id=request_id,
+            url=url,
+            retry_after=e.retry_after
+        )
+        raise
+    except aiohttp.ClientSSLError as e:
         error_msg = f"SSL连接失败，请检查图片URL是否正确"
         logger.error(
             f"SSL connection error: {str(e)}",
@@ -110,7 +220,7 @@ def download_image(url, request_id='unknown'):
             stack_trace=traceback.format_exc()
         )
         raise Exception(error_msg)
-    except requests.exceptions.Timeout as e:
+    except asyncio.TimeoutError as e:
         error_msg = f"下载超时，请检查图片URL是否可访问或增加超时设置"
         logger.error(
             f"Download timeout: {str(e)}",
@@ -120,7 +230,7 @@ def download_image(url, request_id='unknown'):
             error_type=type(e).__name__
         )
         raise Exception(error_msg)
-    except requests.exceptions.RequestException as e:
+    except aiohttp.ClientError as e:
         error_msg = f"网络请求失败: {str(e)}"
         logger.error(
             f"Network request error: {str(e)}",
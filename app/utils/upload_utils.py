@@ -0,0 +1,121 @@
+from python_multipart.multipart import MultipartParser, parse_options_header
+from ..core.config import settings
+from .image_format import ImageIngest, ImageIngestError
+from .image_utils import DownloadedImage
+
+
+class UploadError(Exception):
+    """上传请求本身不合法(格式错误或文件过多)"""
+
+
+class _UploadPart:
+    """正在接收的multipart分段"""
+
+    def __init__(self):
+        self.headers = {}
+        self.filename = None
+        self.ingest = None
+        self.error = None
+
+    def start_body(self):
+        disposition, options = parse_options_header(self.headers.get(b'content-disposition'))
+        filename = options.get(b'filename')
+        content_type, _ = parse_options_header(self.headers.get(b'content-type'))
+        if filename is not None or content_type.startswith((b'image/', b'application/octet-stream')):
+            self.filename = filename.decode('utf-8', 'replace') if filename else ''
+            self.ingest = ImageIngest(settings.MAX_IMAGE_BYTES)
+
+    @property
+    def is_file(self):
+        return self.ingest is not None
+
+    def feed(self, data):
+        if self.ingest is None or self.error is not None:
+            return
+        try:
+            self.ingest.feed(data)
+        except ImageIngestError as e:
+            # 超出大小限制或不是图片: 丢弃该分段剩余数据，继续解析后续文件
+            self.error = e
+
+    def finish(self):
+        """返回DownloadedImage或ImageIngestError"""
+        if self.error is None:
+            try:
+                data, mime_type = self.ingest.finish()
+                return DownloadedImage(data=data, mime_type=mime_type)
+            except ImageIngestError as e:
+                self.error = e
+        self.ingest = None
+        return self.error
+
+
+async def iter_multipart_images(stream, content_type, max_files):
+    """流式解析multipart请求体，每收到一个完整文件就产出(序号, 文件名, DownloadedImage或ImageIngestError)
+
+    文件数据只保存在内存中，不写临时文件；调用方处理完已产出的文件前不会继续读取请求体
+    """
+    _, options = parse_options_header(content_type)
+    boundary = options.get(b'boundary')
+    if not boundary:
+        raise UploadError('multipart请求缺少boundary')
+
+    state = {'part': None, 'field': b'', 'value': b''}
+    completed = []
+
+    def on_part_begin():
+        state['part'] = _UploadPart()
+
+    def on_header_field(data, start, end):
+        state['field'] += data[start:end]
+
+    def on_header_value(data, start, end):
+        state['value'] += data[start:end]
+
+    def on_header_end():
+        state['part'].headers[state['field'].lower()] = state['value']
+        state['field'] = state['value'] = b''
+
+    def on_headers_finished():
+        state['part'].start_body()
+
+    def on_part_data(data, start, end):
+        state['part'].feed(data[start:end])
+
+    def on_part_end():
+        part, state['part'] = state['part'], None
+        if part.is_file:
+            completed.append((part.filename, part.finish()))
+
+    parser = MultipartParser(boundary, {
+        'on_part_begin': on_part_begin,
+        'on_header_field': on_header_field,
+        'on_header_value': on_header_value,
+        'on_header_end': on_header_end,
+        'on_headers_finished': on_headers_finished,
+        'on_part_data': on_part_data,
+        'on_part_end': on_part_end
+    })
+
+    index = 0
+    async for chunk in stream:
+        try:
+            parser.write(chunk)
+        except Exception as e:
+            raise UploadError(f'multipart请求格式错误: {e}')
+        while completed:
+            if index >= max_files:
+                raise UploadError(f'单次最多上传{max_files}个文件')
+            filename, image = completed.pop(0)
+            yield index, filename, image
+            index += 1
+    parser.finalize()
+
+
+async def read_image_body(stream):
+    """读取单张图片的原始请求体(嗅探格式并限制大小)，返回DownloadedImage"""
+    ingest = ImageIngest(settings.MAX_IMAGE_BYTES)
+    async for chunk in stream:
+        ingest.feed(chunk)
+    data, mime_type = ingest.finish()
+    return DownloadedImage(data=data, mime_type=mime_type)
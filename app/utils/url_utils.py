@@ -1,5 +1,5 @@
 import re
-from urllib.parse import urlparse, parse_qs
+from urllib.parse import urlparse, urlunparse, parse_qs
 from ..core.logging import logger
 
 
@@ -92,7 +92,7 @@ def ensure_valid_mime_type_for_gemini(mime_type, url=None, request_id='unknown')
     # Gemini API支持的图片MIME类型
     supported_types = [
         'image/jpeg', 'image/jpg', 'image/png', 'image/gif',
-        'image/webp', 'image/bmp', 'image/tiff'
+        'image/webp', 'image/bmp', 'image/tiff', 'image/heic', 'image/heif'
     ]
 
     mime_type = mime_type.lower()
@@ -166,4 +166,35 @@ def ensure_valid_mime_type_for_gemini(mime_type, url=None, request_id='unknown')
         request_id=request_id,
         original_mime_type=mime_type
     )
-    return 'image/jpeg' 
\ No newline at end of file
+    return 'image/jpeg' 
+
+def parse_cache_control(cache_control):
+    """解析Cache-Control响应头，返回{指令: 值}，无值的指令为True"""
+    directives = {}
+    if not cache_control:
+        return directives
+    for part in cache_control.split(','):
+        part = part.strip().lower()
+        if not part:
+            continue
+        name, _, value = part.partition('=')
+        value = value.strip().strip('"')
+        if value.isdigit():
+            directives[name.strip()] = int(value)
+        else:
+            directives[name.strip()] = value or True
+    return directives
+
+
+def normalize_url(url):
+    """规范化URL用于去重: 去除首尾空白和片段，协议和主机名小写，去掉默认端口"""
+    url = url.strip()
+    try:
+        parsed = urlparse(url)
+    except ValueError:
+        return url
+    scheme = parsed.scheme.lower()
+    netloc = parsed.netloc.lower()
+    if (scheme == 'http' and netloc.endswith(':80')) or (scheme == 'https' and netloc.endswith(':443')):
+        netloc = netloc.rsplit(':', 1)[0]
+    return urlunparse((scheme, netloc, parsed.path or '/', parsed.params, parsed.query, ''))
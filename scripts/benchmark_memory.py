@@ -0,0 +1,53 @@
+"""下载 -> 分析 图片数据传递的内存基准
+
+对比旧流程(下载后base64编码为str，分析前再解码)和新流程(直接传递原始字节)
+在同时持有多张大图时的峰值内存。
+
+用法: python scripts/benchmark_memory.py [图片数量] [每张图片MB]
+"""
+import base64
+import os
+import sys
+import tracemalloc
+
+from google.genai import types
+
+
+def legacy_pipeline(payloads):
+    """旧流程: bytes -> base64 str -> bytes -> Part"""
+    encoded = [base64.b64encode(data).decode('utf-8') for data in payloads]
+    return [
+        types.Part.from_bytes(mime_type='image/jpeg', data=base64.b64decode(item))
+        for item in encoded
+    ], encoded
+
+
+def raw_bytes_pipeline(payloads):
+    """新流程: bytes -> Part"""
+    return [types.Part.from_bytes(mime_type='image/jpeg', data=data) for data in payloads], None
+
+
+def measure(pipeline, count, size):
+    payloads = [os.urandom(size) for _ in range(count)]
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    result = pipeline(payloads)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return peak
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    size_mb = float(sys.argv[2]) if len(sys.argv) > 2 else 4
+    size = int(size_mb * 1024 * 1024)
+
+    print(f"图片数量: {count}, 每张: {size_mb}MB, 原始数据总计: {count * size_mb:.1f}MB")
+    for name, pipeline in (("base64往返(旧)", legacy_pipeline), ("原始字节(新)", raw_bytes_pipeline)):
+        peak = measure(pipeline, count, size)
+        print(f"{name}: 额外峰值内存 {peak / 1024 / 1024:.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+import os
+
+# 测试使用本地假客户端，不访问Gemini，只需通过配置校验
+os.environ.setdefault('GEMINI_API_KEY', 'test-key-0000')
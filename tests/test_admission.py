@@ -0,0 +1,44 @@
+import asyncio
+import pytest
+from app.services.admission import AdmissionController, AdmissionRejected, DEFAULT_STAGE_SECONDS
+from app.services.scheduler import FairScheduler, LANE_WEIGHTS, INTERACTIVE
+from app.utils.deadline import Deadline
+
+
+def _controller(download_slots=10, analysis_slots=3):
+    return AdmissionController(
+        FairScheduler('test_download', download_slots, LANE_WEIGHTS),
+        FairScheduler('test_analysis', analysis_slots, LANE_WEIGHTS)
+    )
+
+
+def test_single_image_counts_each_stage_once():
+    controller = _controller()
+    expected = controller.service_time('download') + controller.service_time('analysis')
+    assert controller.estimate_seconds(1, INTERACTIVE) == pytest.approx(expected)
+    assert set(DEFAULT_STAGE_SECONDS) == {'download', 'analysis'}
+
+
+def test_estimate_grows_with_queue_depth():
+    controller = _controller(analysis_slots=3)
+    analysis = controller.service_time('analysis')
+    download = controller.service_time('download')
+    # 30张图片在3个分析槽位上需要10轮，再加一张图片的下载耗时
+    assert controller.estimate_seconds(30, INTERACTIVE) == pytest.approx(10 * analysis + download)
+
+
+def test_idle_lane_is_never_rejected_on_estimate():
+    async def scenario():
+        controller = _controller()
+        ticket = controller.admit(3, INTERACTIVE, Deadline(0.1, 0.4, 0.3))
+        assert controller.in_system[INTERACTIVE] == 3
+
+        # 同通道已有图片在处理时，预计无法在预算内完成的请求被拒绝
+        with pytest.raises(AdmissionRejected) as rejected:
+            controller.admit(3, INTERACTIVE, Deadline(0.1, 0.4, 0.3))
+        assert rejected.value.reason == 'deadline'
+
+        ticket.close()
+        assert controller.in_system[INTERACTIVE] == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,77 @@
+import asyncio
+import pytest
+from app.services.memory_budget import ByteBudget
+from app.services.scheduler import FairScheduler, LANE_WEIGHTS
+
+
+async def _download(budget, scheduler, size, reserve, finished):
+    """按process_image的顺序: 预留 -> 等待下载槽位 -> 按Content-Length补足 -> 分析后归还"""
+    lease = budget.lease()
+    try:
+        await lease.reserve(reserve)
+        async with scheduler.slot():
+            lease.activate()
+            await lease.top_up_to(size)
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.01)
+        finished.append(size)
+    finally:
+        lease.release()
+
+
+def test_queued_reservations_do_not_block_slot_top_ups():
+    async def scenario():
+        budget = ByteBudget(10)
+        scheduler = FairScheduler('test_download', 2, LANE_WEIGHTS)
+        finished = []
+        # 排队等待槽位的图片的预留占满预算，持有槽位的下载仍能补足
+        await asyncio.wait_for(
+            asyncio.gather(*(_download(budget, scheduler, 3, 2, finished) for _ in range(6))),
+            timeout=5
+        )
+        assert len(finished) == 6
+        assert budget.in_use == 0
+        assert budget.idle == 0
+        assert budget.waiting == 0
+
+    asyncio.run(scenario())
+
+
+def test_top_up_waits_for_resident_bytes():
+    async def scenario():
+        budget = ByteBudget(10)
+        resident = budget.lease()
+        await resident.acquire(8)
+
+        downloading = budget.lease()
+        await downloading.reserve(2)
+        downloading.activate()
+        top_up = asyncio.ensure_future(downloading.top_up_to(5))
+        await asyncio.sleep(0)
+        assert not top_up.done()
+
+        # 补足请求等待期间，新的预留排在其后
+        queued = asyncio.ensure_future(budget.lease().reserve(1))
+        resident.release()
+        await asyncio.wait_for(top_up, timeout=1)
+        await asyncio.wait_for(queued, timeout=1)
+        assert budget.in_use == 6
+        assert budget.idle == 1
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_popped_by_release_raises_cancelled():
+    async def scenario():
+        budget = ByteBudget(10)
+        await budget.acquire(10)
+        waiter = asyncio.ensure_future(budget.acquire(5))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        budget.release(10)
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert budget.in_use == 0
+        assert budget.waiting == 0
+
+    asyncio.run(scenario())
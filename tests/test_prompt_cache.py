@@ -0,0 +1,240 @@
+import asyncio
+import pytest
+from google.genai import errors, types
+from app.services import gemini_service
+from app.services.prompt_cache import PromptCache, is_cache_rejection
+
+
+SYSTEM_PROMPT = 'You are a room classifier.'
+
+
+class FakeCaches:
+    """本地假的Gemini缓存接口，记录create/update调用"""
+
+    def __init__(self, fail_create=False):
+        self.fail_create = fail_create
+        self.created = []
+        self.updated = []
+
+    async def create(self, model, config):
+        if self.fail_create:
+            raise errors.ClientError(400, {'error': {
+                'code': 400, 'status': 'INVALID_ARGUMENT', 'message': 'Cached content is too small'
+            }})
+        self.created.append(config)
+        name = f"cachedContents/{len(self.created)}"
+        return type('CachedContent', (), {'name': name, 'usage_metadata': None})()
+
+    async def update(self, name, config):
+        self.updated.append((name, config))
+
+
+class FakeModels:
+    """本地假的generate_content，按需拒绝缓存引用或请求本身"""
+
+    def __init__(self, reject_cache=False, error=None):
+        self.reject_cache = reject_cache
+        self.error = error
+        self.configs = []
+
+    async def generate_content(self, model, contents, config):
+        self.configs.append(config)
+        if self.error is not None:
+            raise self.error
+        if config.cached_content and self.reject_cache:
+            raise errors.ClientError(403, {'error': {
+                'code': 403, 'status': 'PERMISSION_DENIED',
+                'message': 'CachedContent not found (or permission denied)'
+            }})
+        return 'ok'
+
+
+class FakeClient:
+    def __init__(self, caches=None, models=None):
+        self.aio = type('Aio', (), {'caches': caches or FakeCaches(), 'models': models or FakeModels()})()
+
+
+class FakeClock:
+    """手动推进的时钟，避免测试依赖真实等待"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def _config():
+    return types.GenerateContentConfig(system_instruction=SYSTEM_PROMPT, temperature=0.1)
+
+
+def _cache(client, ttl=60, refresh_margin=10, retry_seconds=60, clock=None):
+    return PromptCache(
+        'gemini-test', ttl, refresh_margin, retry_seconds,
+        get_client=lambda api_key: client, clock=clock or FakeClock()
+    )
+
+
+async def _settle(cache):
+    """等待后台的创建/续期任务完成"""
+    tasks = [entry.task for entry in cache._entries.values() if entry.task is not None]
+    if tasks:
+        await asyncio.gather(*tasks)
+    await asyncio.sleep(0)
+
+
+def test_create_failure_uses_inline_prompt():
+    async def scenario():
+        client = FakeClient(caches=FakeCaches(fail_create=True))
+        clock = FakeClock()
+        cache = _cache(client, retry_seconds=30, clock=clock)
+        config = _config()
+
+        assert cache.resolve('key-a', config) is config
+        await _settle(cache)
+        # 创建失败后在retry_seconds内不再重试，继续使用内联提示词
+        assert cache.resolve('key-a', config) is config
+        await _settle(cache)
+        assert len(client.aio.caches.created) == 0
+
+        client.aio.caches.fail_create = False
+        clock.advance(31)
+        cache.resolve('key-a', config)
+        await _settle(cache)
+        assert cache.resolve('key-a', config).cached_content == 'cachedContents/1'
+
+    asyncio.run(scenario())
+
+
+def test_resolve_references_cache_once_created():
+    async def scenario():
+        client = FakeClient()
+        cache = _cache(client)
+        config = _config()
+
+        # 首次使用时缓存尚未就绪，先内联发送
+        assert cache.resolve('key-a', config) is config
+        await _settle(cache)
+
+        cached_config = cache.resolve('key-a', config)
+        assert cached_config.cached_content == 'cachedContents/1'
+        assert cached_config.system_instruction is None
+        assert cached_config.temperature == config.temperature
+        assert config.system_instruction == SYSTEM_PROMPT
+
+        created = client.aio.caches.created
+        assert len(created) == 1
+        assert created[0].system_instruction == SYSTEM_PROMPT
+        assert created[0].ttl == '60s'
+
+        # 每个密钥单独创建缓存
+        cache.resolve('key-b', config)
+        await _settle(cache)
+        assert cache.resolve('key-b', config).cached_content == 'cachedContents/2'
+        assert len(created) == 2
+
+    asyncio.run(scenario())
+
+
+def test_refreshes_before_expiry():
+    async def scenario():
+        client = FakeClient()
+        clock = FakeClock()
+        cache = _cache(client, ttl=60, refresh_margin=10, clock=clock)
+        config = _config()
+
+        cache.resolve('key-a', config)
+        await _settle(cache)
+        cache.resolve('key-a', config)
+        await _settle(cache)
+        assert client.aio.caches.updated == []
+
+        clock.advance(55)
+        # 剩余有效期不足refresh_margin: 续期期间继续使用缓存
+        assert cache.resolve('key-a', config).cached_content == 'cachedContents/1'
+        await _settle(cache)
+        name, update_config = client.aio.caches.updated[0]
+        assert name == 'cachedContents/1'
+        assert update_config.ttl == '60s'
+        assert cache.snapshot()[0]['expires_in'] == 60
+        assert len(client.aio.caches.created) == 1
+
+    asyncio.run(scenario())
+
+
+def test_invalidate_falls_back_and_recreates():
+    async def scenario():
+        client = FakeClient()
+        cache = _cache(client)
+        config = _config()
+
+        cache.resolve('key-a', config)
+        await _settle(cache)
+        assert cache.resolve('key-a', config).cached_content == 'cachedContents/1'
+
+        cache.invalidate('key-a', config)
+        assert cache.resolve('key-a', config) is config
+        await _settle(cache)
+        assert cache.resolve('key-a', config).cached_content == 'cachedContents/2'
+
+    asyncio.run(scenario())
+
+
+def test_is_cache_rejection():
+    rejected = errors.ClientError(404, {'error': {'code': 404, 'message': 'CachedContent not found'}})
+    bad_image = errors.ClientError(400, {'error': {'code': 400, 'message': 'Unable to process input image'}})
+    rate_limited = errors.ClientError(429, {'error': {'code': 429, 'message': 'Resource exhausted'}})
+    assert is_cache_rejection(rejected)
+    assert not is_cache_rejection(bad_image)
+    assert not is_cache_rejection(rate_limited)
+
+
+def _patch_gemini_service(monkeypatch, client, cache):
+    monkeypatch.setattr(gemini_service.settings, 'PROMPT_CACHE_ENABLED', True)
+    monkeypatch.setattr(gemini_service, 'prompt_cache', cache)
+    monkeypatch.setattr(
+        gemini_service, 'gemini_client_manager',
+        type('Manager', (), {'get_client': staticmethod(lambda api_key=None: client)})()
+    )
+
+
+def test_rejected_cache_is_resent_inline(monkeypatch):
+    async def scenario():
+        models = FakeModels(reject_cache=True)
+        client = FakeClient(models=models)
+        cache = _cache(client)
+        _patch_gemini_service(monkeypatch, client, cache)
+        config = _config()
+
+        cache.resolve('key-a', config)
+        await _settle(cache)
+        response = await gemini_service._generate_with_prompt_cache('key-a', 'gemini-test', [], config)
+        assert response == 'ok'
+        assert [c.cached_content for c in models.configs] == ['cachedContents/1', None]
+        assert cache.snapshot()[0]['cache_name'] is None
+
+    asyncio.run(scenario())
+
+
+def test_request_error_is_not_resent_inline(monkeypatch):
+    async def scenario():
+        bad_image = errors.ClientError(400, {'error': {'code': 400, 'message': 'Unable to process input image'}})
+        models = FakeModels(error=bad_image)
+        client = FakeClient(models=models)
+        cache = _cache(client)
+        _patch_gemini_service(monkeypatch, client, cache)
+        config = _config()
+
+        cache.resolve('key-a', config)
+        await _settle(cache)
+        with pytest.raises(errors.ClientError) as raised:
+            await gemini_service._generate_with_prompt_cache('key-a', 'gemini-test', [], config)
+        assert raised.value.code == 400
+        # 只调用一次模型，缓存保留
+        assert len(models.configs) == 1
+        assert cache.snapshot()[0]['cache_name'] == 'cachedContents/1'
+
+    asyncio.run(scenario())
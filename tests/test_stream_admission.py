@@ -0,0 +1,37 @@
+import asyncio
+import pytest
+from starlette.requests import ClientDisconnect
+from app.api.v1.endpoints.analyze import _AdmittedStreamingResponse
+from app.services.admission import AdmissionController
+from app.services.scheduler import FairScheduler, LANE_WEIGHTS, BULK
+
+
+def test_ticket_released_when_client_disconnects_before_streaming():
+    async def scenario():
+        controller = AdmissionController(
+            FairScheduler('test_download', 2, LANE_WEIGHTS),
+            FairScheduler('test_analysis', 2, LANE_WEIGHTS)
+        )
+        ticket = controller.admit(10, BULK)
+        started = []
+
+        async def results():
+            # 正常情况下由生成器的finally归还名额，这里生成器从未开始迭代
+            started.append(True)
+            yield b'{}\n'
+
+        async def send(message):
+            raise OSError('client disconnected')
+
+        async def receive():
+            return {'type': 'http.disconnect'}
+
+        response = _AdmittedStreamingResponse(results(), ticket, media_type='application/x-ndjson')
+        scope = {'type': 'http', 'asgi': {'spec_version': '2.4'}}
+        with pytest.raises(ClientDisconnect):
+            await response(scope, receive, send)
+
+        assert started == []
+        assert controller.in_system[BULK] == 0
+
+    asyncio.run(scenario())